@@ -0,0 +1,89 @@
+import os
+import re
+import json
+import zipfile
+import threading
+
+# Default values
+INDEX = '.archive_index.json'
+S1_PATTERN = '^[^_]+_[^_]+_[^_]+_[^_]+_(\d{8}T\d{6})_' # S1A_IW_GRDH_1SDV_20171227T223338_...
+S2_PATTERN = '^[^_]+_[^_]+_(\d{8}T\d{6})_' # S2A_MSIL2A_20190709T025559_...
+
+def safe_name(fnam,pattern):
+    # Name of the .SAFE directory in a (renamed) zip file
+    with zipfile.ZipFile(fnam) as z:
+        for d in z.namelist():
+            dnam = os.path.dirname(d)
+            if re.search('^\S+\.SAFE$',dnam) and re.search(pattern,dnam):
+                return os.path.splitext(dnam)[0]
+    return None
+
+class ArchiveIndex:
+    # Persistent record of the archive (datdir/YYYY/*.zip|*.SAFE):
+    # path -> {size, mtime, safe (SAFE name w/o extension), dtim (YYYYmmddTHHMMSS), status}.
+    # A year directory is listed again only when its mtime changes, and a zip file
+    # is opened only when its name does not tell the SAFE name and it is new or modified.
+    def __init__(self,fnam=INDEX,pattern=S1_PATTERN):
+        self.fnam = fnam
+        self.pattern = pattern
+        self.lock = threading.Lock()
+        self.dirs = {}
+        self.entries = {}
+        if os.path.exists(fnam):
+            with open(fnam,'r') as fp:
+                data = json.load(fp)
+            self.dirs = data['dirs']
+            self.entries = data['entries']
+
+    def save(self):
+        with self.lock:
+            tmp_fnam = self.fnam+'.{}'.format(os.getpid())
+            with open(tmp_fnam,'w') as fp:
+                json.dump({'dirs':self.dirs,'entries':self.entries},fp,indent=1,sort_keys=True)
+            os.replace(tmp_fnam,self.fnam)
+
+    def get_entry(self,path):
+        st = os.stat(path)
+        entry = self.entries.get(path)
+        if entry is not None and entry['size'] == st.st_size and entry['mtime'] == st.st_mtime:
+            return entry
+        f,e = os.path.splitext(os.path.basename(path))
+        if re.search(self.pattern,f):
+            safe = f
+        elif e.lower() == '.zip':
+            safe = safe_name(path,self.pattern)
+        else:
+            safe = None
+        dtim = None
+        if safe is not None:
+            dtim = re.search(self.pattern,safe).group(1)
+        return {'size':st.st_size,'mtime':st.st_mtime,'safe':safe,'dtim':dtim,'status':None}
+
+    def scan(self,datdir,year,rescan=False):
+        # Return entries in datdir/year, sorted by path
+        dnam = os.path.join(datdir,str(year))
+        if not os.path.isdir(dnam):
+            return []
+        mtime = os.stat(dnam).st_mtime
+        if rescan or self.dirs.get(dnam) != mtime:
+            entries = {}
+            for f in sorted(os.listdir(dnam)):
+                if not re.search('\.(zip|SAFE)$',f):
+                    continue
+                path = os.path.join(dnam,f)
+                entries[path] = self.get_entry(path)
+            with self.lock:
+                for path in [p for p in self.entries if os.path.dirname(p) == dnam]:
+                    del self.entries[path]
+                self.entries.update(entries)
+                self.dirs[dnam] = mtime
+            self.save()
+        with self.lock:
+            return [dict(path=p,**self.entries[p]) for p in sorted(self.entries) if os.path.dirname(p) == dnam]
+
+    def set_status(self,path,status,save=True):
+        with self.lock:
+            if path in self.entries:
+                self.entries[path]['status'] = status
+        if save:
+            self.save()
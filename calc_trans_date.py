@@ -11,6 +11,7 @@ from matplotlib.dates import date2num,num2date
 from csaps import UnivariateCubicSmoothingSpline
 from scipy.signal import find_peaks
 import matplotlib.pyplot as plt
+from gtiff_writer import write_tiff
 from optparse import OptionParser,IndentedHelpFormatter
 
 # Default values
@@ -296,17 +297,5 @@ for i in range(ngrd):
 if opts.npy_fnam is not None:
     np.save(opts.npy_fnam,output_data)
 
-drv = gdal.GetDriverByName('GTiff')
-ds = drv.Create(opts.out_fnam,nx,ny,nb,gdal.GDT_Float32)
-ds.SetGeoTransform(data_trans)
-srs = osr.SpatialReference()
-srs.ImportFromEPSG(output_epsg)
-ds.SetProjection(srs.ExportToWkt())
 band_name = ['xpek','ypek']
-for i in range(nb):
-    band = ds.GetRasterBand(i+1)
-    band.WriteArray(output_data[i])
-    band.SetDescription(band_name[i])
-band.SetNoDataValue(np.nan) # The TIFFTAG_GDAL_NODATA only support one value per dataset
-ds.FlushCache()
-ds = None # close dataset
+write_tiff(opts.out_fnam,output_data,data_trans,epsg=output_epsg,band_name=band_name)
@@ -0,0 +1,49 @@
+import os
+import sys
+import shutil
+import numpy as np
+import shapefile
+
+def group_fields(sid,values,nobject,cnd=None):
+    # Assign values of items (peaks etc.) to their fields in one pass.
+    # sid: field index of each item, values: (nval,nitem) array, cnd: item selection.
+    # Returns (nval,nobject) array (NaN for fields without items) and number of items per field.
+    sid = np.asarray(sid).astype(np.int64)
+    values = np.atleast_2d(np.asarray(values,dtype=np.float64))
+    if cnd is not None:
+        sid = sid[cnd]
+        values = values[:,cnd]
+    cnd = (sid >= 0) & (sid < nobject)
+    if not cnd.all(): # items outside the records are ignored
+        sys.stderr.write('Warning, {} items out of range (nobject={}) are ignored.\n'.format((~cnd).sum(),nobject))
+        sid = sid[cnd]
+        values = values[:,cnd]
+    count = np.bincount(sid,minlength=nobject)
+    if count.max(initial=0) > 1:
+        i = np.argmax(count > 1)
+        raise ValueError('Error, i={}, ndat={}'.format(i,count[i]))
+    data = np.full((values.shape[0],nobject),np.nan)
+    data[:,sid] = values
+    return data,count
+
+def write_fields(inpnam,outnam,data,band_name,fill=None):
+    # Copy a shapefile and append per-field values, data: (nval,nrecord) array in record order.
+    # fill: value written for NaN (NaN is kept if None)
+    r = shapefile.Reader(inpnam)
+    if data.shape != (len(band_name),len(r)):
+        raise ValueError('Error, data.shape={}, nband={}, nrecord={}'.format(data.shape,len(band_name),len(r)))
+    if fill is not None:
+        data = np.where(np.isnan(data),fill,data)
+    w = shapefile.Writer(outnam)
+    w.shapeType = r.shapeType
+    w.fields = r.fields[1:] # skip first deletion field
+    for band in band_name:
+        w.field(band,'F',13,6)
+    for i,shaperec in enumerate(r.iterShapeRecords()):
+        rec = shaperec.record
+        rec.extend(data[:,i].tolist())
+        w.shape(shaperec.shape)
+        w.record(*rec)
+    w.close()
+    if os.path.exists(inpnam+'.prj'):
+        shutil.copy2(inpnam+'.prj',outnam+'.prj')
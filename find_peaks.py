@@ -49,6 +49,7 @@ parser.add_option('--ax2_ymax',default=None,type='float',help='Axis2 Y max. (%de
 parser.add_option('--ax2_ystp',default=None,type='float',help='Axis2 Y step. (%default)')
 parser.add_option('-S','--subpeak',default=False,action='store_true',help='Output sub peaks (%default)')
 parser.add_option('-z','--npz',default=False,action='store_true',help='NPZ mode (%default)')
+parser.add_option('--stack',default=None,help='Read all windows from a stacked npz file of get_vh_minimum.py (%default)')
 parser.add_option('--vint',default=VINT,type='int',help='Verbose output interval (%default)')
 parser.add_option('-v','--verbose',default=False,action='store_true',help='Verbose mode (%default)')
 parser.add_option('-d','--debug',default=False,action='store_true',help='Debug mode (%default)')
@@ -61,6 +62,45 @@ if opts.npz:
 else:
     fs = sorted(glob(os.path.join(opts.datdir,'collocation_*.dat')))
 
+def read_windows():
+    # Yield (d0,d1,j,tmin,vmin,dstd,fleg,freg,bavg,bstd) of each window ending between d0 and d1
+    if opts.stack is not None: # all windows in one file (get_vh_minimum.py --ends --npz)
+        data = np.load(opts.stack)
+        for iw in range(len(data['d1'])):
+            d0_tmp = datetime.strptime(str(data['d0'][iw]),'%Y%m%d')
+            d1_tmp = datetime.strptime(str(data['d1'][iw]),'%Y%m%d')
+            if d1_tmp < d0 or d1_tmp > d1:
+                continue
+            yield d0_tmp,d1_tmp,data['j'][iw],data['tmin'][iw],data['vmin'][iw],data['dstd'][iw],data['fleg'][iw],data['freg'][iw],data['bavg'][iw],data['bstd'][iw]
+        return
+    for f in fs:
+        if opts.npz:
+            m = re.search('collocation_(\d+)_(\d+).npz',os.path.basename(f))
+        else:
+            m = re.search('collocation_(\d+)_(\d+).dat',os.path.basename(f))
+        if not m:
+            continue
+        d0_tmp = datetime.strptime(m.group(1),'%y%m%d')
+        d1_tmp = datetime.strptime(m.group(2),'%y%m%d')
+        if d1_tmp < d0 or d1_tmp > d1:
+            continue
+        try:
+            if opts.npz:
+                data = np.load(f)
+                j = data['j']
+                tmin = data['tmin']
+                vmin = data['vmin']
+                dstd = data['dstd']
+                fleg = data['fleg']
+                freg = data['freg']
+                bavg = data['bavg']
+                bstd = data['bstd']
+            else:
+                j,ndat,tmin,vmin,fmin,tlft,vlft,flft,trgt,vrgt,frgt,dmin,dstd,tleg,fleg,treg,freg,sstd,scor,traw,vraw,fraw,draw,rstd,rcor,bavg,bstd = np.loadtxt(f,unpack=True)
+        except Exception:
+            continue
+        yield d0_tmp,d1_tmp,j,tmin,vmin,dstd,fleg,freg,bavg,bstd
+
 xmin = 1.0e10
 xmax = -1.0e10
 jdat = None
@@ -72,32 +112,7 @@ fleg_array = []
 freg_array = []
 bavg_array = []
 bstd_array = []
-for i,f in enumerate(fs):
-    if opts.npz:
-        m = re.search('collocation_(\d+)_(\d+).npz',os.path.basename(f))
-    else:
-        m = re.search('collocation_(\d+)_(\d+).dat',os.path.basename(f))
-    if not m:
-        continue
-    d0_tmp = datetime.strptime(m.group(1),'%y%m%d')
-    d1_tmp = datetime.strptime(m.group(2),'%y%m%d')
-    if d1_tmp < d0 or d1_tmp > d1:
-        continue
-    try:
-        if opts.npz:
-            data = np.load(f)
-            j = data['j']
-            tmin = data['tmin']
-            vmin = data['vmin']
-            dstd = data['dstd']
-            fleg = data['fleg']
-            freg = data['freg']
-            bavg = data['bavg']
-            bstd = data['bstd']
-        else:
-            j,ndat,tmin,vmin,fmin,tlft,vlft,flft,trgt,vrgt,frgt,dmin,dstd,tleg,fleg,treg,freg,sstd,scor,traw,vraw,fraw,draw,rstd,rcor,bavg,bstd = np.loadtxt(f,unpack=True)
-    except Exception:
-        continue
+for d0_tmp,d1_tmp,j,tmin,vmin,dstd,fleg,freg,bavg,bstd in read_windows():
     if jdat is None:
         jdat = j
     else:
@@ -0,0 +1,155 @@
+import os
+import re
+import numpy as np
+import xml.etree.ElementTree as ET
+from datetime import datetime
+import gdal
+import osr
+
+# Default values
+GRID_TOLERANCE = 1.0e-6 # relative to pixel size
+
+def dim_bands(fnam):
+    # Band names and ENVI image files of a BEAM-DIMAP product, in band order
+    root = ET.parse(fnam).getroot()
+    names = {}
+    for info in root.iter('Spectral_Band_Info'):
+        names[int(info.find('BAND_INDEX').text)] = info.find('BAND_NAME').text
+    files = {}
+    for data_file in root.iter('Data_File'):
+        indx = int(data_file.find('BAND_INDEX').text)
+        files[indx] = os.path.join(os.path.dirname(os.path.abspath(fnam)),data_file.find('DATA_FILE_PATH').get('href'))
+    bands = []
+    for indx in sorted(names):
+        if indx not in files: # virtual band
+            continue
+        img = re.sub('\.hdr$','.img',files[indx])
+        bands.append((names[indx],img,1))
+    return bands
+
+def tiff_bands(fnam):
+    # Band names of a GeoTIFF from GDAL descriptions or SNAP metadata (tag 65000)
+    ds = gdal.Open(fnam)
+    nband = ds.RasterCount
+    names = [ds.GetRasterBand(i+1).GetDescription() for i in range(nband)]
+    ds = None
+    if names[0] == '':
+        import tifffile
+        with tifffile.TiffFile(fnam) as tif:
+            tags = {tag.name:tag.value for tag in tif.pages[0].tags.values()}
+        if '65000' in tags:
+            names = [value.text for value in ET.fromstring(tags['65000']).iter('BAND_NAME')]
+        else:
+            names = ['band_{}'.format(i+1) for i in range(nband)]
+    if len(names) != nband:
+        raise ValueError('Error, len(names)={}, nband={} >>> {}'.format(len(names),nband,fnam))
+    return [(name,fnam,i+1) for i,name in enumerate(names)]
+
+def get_bands(fnam):
+    # Returns a list of (band name, GDAL file name, band number in the file)
+    if os.path.splitext(fnam)[1].lower() == '.dim':
+        return dim_bands(fnam)
+    return tiff_bands(fnam)
+
+def get_grid(fnam):
+    bands = get_bands(fnam)
+    ds = gdal.Open(bands[0][1])
+    grid = (ds.RasterXSize,ds.RasterYSize,ds.GetGeoTransform(),ds.GetProjection())
+    ds = None
+    return grid
+
+def same_grid(fnams,tolerance=GRID_TOLERANCE):
+    # True if all products have the same size, geotransform and projection
+    nx,ny,trans,prj = get_grid(fnams[0])
+    srs = osr.SpatialReference(wkt=prj)
+    step = min(abs(trans[1]),abs(trans[5]))
+    for fnam in fnams[1:]:
+        nx_i,ny_i,trans_i,prj_i = get_grid(fnam)
+        if nx_i != nx or ny_i != ny:
+            return False
+        if np.abs(np.array(trans_i)-np.array(trans)).max() > tolerance*step:
+            return False
+        if not srs.IsSame(osr.SpatialReference(wkt=prj_i)):
+            return False
+    return True
+
+def file_date(fnam):
+    # YYYYMMDD at the head of the file name, or None
+    dstr = os.path.basename(fnam)[0:8]
+    try:
+        datetime.strptime(dstr,'%Y%m%d')
+    except Exception:
+        return None
+    return dstr
+
+def stack_bands(fnams,band=None,rename=True,exclude=None):
+    # List of (output band name, GDAL file name, band number) for all products.
+    # band: indices of the bands selected from each product, exclude: pattern of band names to skip.
+    # With rename, _YYYYMMDD (from the file name) is attached unless already in the band name.
+    bands = []
+    for fnam in fnams:
+        items = get_bands(fnam)
+        if band is not None:
+            items = [items[j] for j in band]
+        dstr = file_date(fnam) if rename else None
+        if rename and dstr is None:
+            raise ValueError('Error in filename >>> '+fnam)
+        for name,path,iband in items:
+            if exclude is not None and re.search(exclude,name.lower()):
+                continue
+            if dstr is not None and dstr not in name:
+                name = name+'_'+dstr
+            bands.append((name,path,iband))
+    return bands
+
+def write_vrt(bands,output_fnam,grid):
+    # Virtual stack referring to the source files
+    nx,ny,trans,prj = grid
+    root = ET.Element('VRTDataset',rasterXSize=str(nx),rasterYSize=str(ny))
+    ET.SubElement(root,'SRS').text = prj
+    ET.SubElement(root,'GeoTransform').text = ','.join(['{:.17g}'.format(v) for v in trans])
+    for i,(name,path,iband) in enumerate(bands):
+        ds = gdal.Open(path)
+        band_src = ds.GetRasterBand(iband)
+        element = ET.SubElement(root,'VRTRasterBand',dataType=gdal.GetDataTypeName(band_src.DataType),band=str(i+1))
+        ET.SubElement(element,'Description').text = name
+        nodata = band_src.GetNoDataValue()
+        if nodata is not None:
+            ET.SubElement(element,'NoDataValue').text = '{:.17g}'.format(nodata)
+        source = ET.SubElement(element,'SimpleSource')
+        ET.SubElement(source,'SourceFilename',relativeToVRT='0').text = os.path.abspath(path)
+        ET.SubElement(source,'SourceBand').text = str(iband)
+        ds = None
+    ET.ElementTree(root).write(output_fnam)
+
+def write_tiff(bands,output_fnam,grid):
+    # Copy bands one at a time into a Float32 GeoTIFF
+    nx,ny,trans,prj = grid
+    drv = gdal.GetDriverByName('GTiff')
+    ds_out = drv.Create(output_fnam,nx,ny,len(bands),gdal.GDT_Float32,['COMPRESS=LZW','TILED=YES','BIGTIFF=IF_SAFER'])
+    ds_out.SetGeoTransform(trans)
+    ds_out.SetProjection(prj)
+    for i,(name,path,iband) in enumerate(bands):
+        ds = gdal.Open(path)
+        band_src = ds.GetRasterBand(iband)
+        dset = band_src.ReadAsArray().astype(np.float32)
+        nodata = band_src.GetNoDataValue()
+        if nodata is not None and not np.isnan(nodata):
+            dset[dset == nodata] = np.nan
+        ds = None
+        band = ds_out.GetRasterBand(i+1)
+        band.WriteArray(dset)
+        band.SetDescription(name)
+    band.SetNoDataValue(np.nan) # The TIFFTAG_GDAL_NODATA only support one value per dataset
+    ds_out.FlushCache()
+    ds_out = None # close dataset
+
+def stack(fnams,output_fnam,band=None,rename=True,exclude=None):
+    # Stack products on the same grid in one pass, VRT if output_fnam ends with .vrt
+    bands = stack_bands(fnams,band=band,rename=rename,exclude=exclude)
+    grid = get_grid(fnams[0])
+    if os.path.splitext(output_fnam)[1].lower() == '.vrt':
+        write_vrt(bands,output_fnam,grid)
+    else:
+        write_tiff(bands,output_fnam,grid)
+    return output_fnam
@@ -4,16 +4,17 @@ import sys
 import re
 from datetime import datetime,timedelta
 import gdal
-import osr
 import numpy as np
 from csaps import UnivariateCubicSmoothingSpline
 from matplotlib.dates import date2num
+from gtiff_writer import write_tiff
 from optparse import OptionParser,IndentedHelpFormatter
 
 # Default values
 SCL_MIN = 3.9
 SCL_MAX = 7.1
 TIFNAM = 'ndvi_peaks.tif'
+EPSG = 32748
 
 # Read options
 parser = OptionParser(formatter=IndentedHelpFormatter(max_help_position=200,width=200))
@@ -26,6 +27,7 @@ parser.add_option('-l','--scl_min',default=SCL_MIN,type='float',help='Minimum sc
 parser.add_option('-L','--scl_max',default=SCL_MAX,type='float',help='Maximum scene classification value (%default)')
 parser.add_option('-m','--mask',default=None,help='Mask file in GeoTIFF/npy format (%default)')
 parser.add_option('-o','--tifnam',default=TIFNAM,help='Output GeoTIFF name (%default)')
+parser.add_option('-e','--epsg',default=EPSG,type='int',help='Output EPSG (%default)')
 (opts,args) = parser.parse_args()
 if len(args) < 1:
     parser.print_help()
@@ -147,17 +149,5 @@ for iline in range(ny):
 np.save('ndvi_data.npy',ndvi_data)
 
 # Output results
-drv = gdal.GetDriverByName('GTiff')
-ds = drv.Create(opts.tifnam,nx,ny,4,gdal.GDT_Float32,['COMPRESS=LZW','TILED=YES'])
-ds.SetGeoTransform((xmin,xstp,0.0,ymax,0.0,ystp))
-srs = osr.SpatialReference()
-srs.ImportFromEPSG(32748)
-ds.SetProjection(srs.ExportToWkt())
 band_name = ['planting_date','planting_ndvi','heading_date','heading_ndvi']
-for i in range(4):
-    band = ds.GetRasterBand(i+1)
-    band.WriteArray(ndvi_data[i])
-    band.SetDescription(band_name[i])
-band.SetNoDataValue(np.nan) # The TIFFTAG_GDAL_NODATA only support one value per dataset
-ds.FlushCache()
-ds = None # close dataset
+write_tiff(opts.tifnam,ndvi_data,(xmin,xstp,0.0,ymax,0.0,ystp),epsg=opts.epsg,band_name=band_name)
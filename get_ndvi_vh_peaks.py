@@ -1,7 +1,6 @@
 #!/usr/bin/env python
 import os
 import sys
-import shutil
 import re
 from datetime import datetime,timedelta
 import gdal
@@ -12,6 +11,7 @@ from scipy.signal import find_peaks
 from csaps import UnivariateCubicSmoothingSpline
 from matplotlib.dates import date2num
 from matplotlib.path import Path
+from field_join import write_fields
 from optparse import OptionParser,IndentedHelpFormatter
 
 # Default values
@@ -370,18 +370,5 @@ if opts.npynam is not None:
 
 # Output results
 if opts.outnam is not None:
-    w = shapefile.Writer(opts.outnam)
-    w.shapeType = shapefile.POLYGON
-    w.fields = r.fields[1:] # skip first deletion field
     band_name = ['planting_date','planting_ndvi','heading_date','heading_ndvi','sen1_min_date','sen1_min_peak','sen1_near_value','sen1_near_peak']
-    for band in band_name:
-        w.field(band,'F',13,6)
-    for i,shaperec in enumerate(r.iterShapeRecords()):
-        rec = shaperec.record
-        shp = shaperec.shape
-        for j in range(len(band_name)):
-            rec.append(peak_data[j,i])
-        w.shape(shp)
-        w.record(*rec)
-    w.close()
-    shutil.copy2(opts.shpnam+'.prj',opts.outnam+'.prj')
+    write_fields(opts.shpnam,opts.outnam,peak_data,band_name)
@@ -4,11 +4,11 @@ import sys
 import re
 from datetime import datetime,timedelta
 import gdal
-import osr
 import numpy as np
 from scipy.signal import find_peaks
 from csaps import UnivariateCubicSmoothingSpline
 from matplotlib.dates import date2num
+from gtiff_writer import write_tiff
 from optparse import OptionParser,IndentedHelpFormatter
 
 # Default values
@@ -24,6 +24,7 @@ POLARIZATION = 'VH'
 NPYNAM = 'peak_data.npy'
 TIFNAM = 'peak_data.tif'
 INCIDENCE_ANGLE = 'incidence_angle.dat'
+EPSG = 32748
 
 # Read options
 parser = OptionParser(formatter=IndentedHelpFormatter(max_help_position=200,width=200))
@@ -46,6 +47,7 @@ parser.add_option('-i','--incidence_list',default=None,help='Incidence angle lis
 parser.add_option('-m','--mask',default=None,help='Mask file in GeoTIFF/npy format (%default)')
 parser.add_option('-o','--npynam',default=NPYNAM,help='Output NPY name (%default)')
 parser.add_option('-O','--tifnam',default=TIFNAM,help='Output GeoTIFF name (%default)')
+parser.add_option('-e','--epsg',default=EPSG,type='int',help='Output EPSG (%default)')
 (opts,args) = parser.parse_args()
 if len(args) < 2:
     parser.print_help()
@@ -329,17 +331,5 @@ if opts.npynam is not None:
 
 # Output results
 if opts.tifnam is not None:
-    drv = gdal.GetDriverByName('GTiff')
-    ds = drv.Create(opts.tifnam,nx,ny,8,gdal.GDT_Float32,['COMPRESS=LZW','TILED=YES'])
-    ds.SetGeoTransform((xmin,xstp,0.0,ymax,0.0,ystp))
-    srs = osr.SpatialReference()
-    srs.ImportFromEPSG(32748)
-    ds.SetProjection(srs.ExportToWkt())
     band_name = ['planting_date','planting_ndvi','heading_date','heading_ndvi','sen1_min_date','sen1_min_peak','sen1_near_value','sen1_near_peak']
-    for i in range(8):
-        band = ds.GetRasterBand(i+1)
-        band.WriteArray(peak_data[i])
-        band.SetDescription(band_name[i])
-    band.SetNoDataValue(np.nan) # The TIFFTAG_GDAL_NODATA only support one value per dataset
-    ds.FlushCache()
-    ds = None # close dataset
+    write_tiff(opts.tifnam,peak_data,(xmin,xstp,0.0,ymax,0.0,ystp),epsg=opts.epsg,band_name=band_name)
@@ -25,12 +25,14 @@ MAXDIS = 100.0 # m
 VINT = 100
 SHPNAM = os.path.join('New_Test_Sites','New_Test_Sites.shp')
 DATNAM = 'transplanting_date.dat'
+NPZNAM = 'collocation_windows.npz'
 FIGNAM = 'transplanting_date.pdf'
 
 # Read options
 parser = OptionParser(formatter=IndentedHelpFormatter(max_help_position=200,width=200))
 parser.set_usage('Usage: %prog collocated_geotiff_file [options]')
 parser.add_option('-e','--end',default=END,help='End date of the analysis in the format YYYYMMDD (%default)')
+parser.add_option('-E','--ends',default=None,help='Comma-separated end dates in the format YYYYMMDD for multi-window mode (%default)')
 parser.add_option('-p','--period',default=PERIOD,type='int',help='Observation period in day (%default)')
 parser.add_option('-i','--ind',default=None,type='int',action='append',help='Selected indices (%default)')
 parser.add_option('--trans_date',default=None,help='Transplanting date file (%default)')
@@ -38,6 +40,9 @@ parser.add_option('-w','--sigwid',default=SIGWID,type='float',help='Signal width
 parser.add_option('-m','--maxdis',default=MAXDIS,type='float',help='Max distance in m (%default)')
 parser.add_option('-s','--shpnam',default=SHPNAM,help='Input shapefile name (%default)')
 parser.add_option('-o','--datnam',default=DATNAM,help='Output data name (%default)')
+parser.add_option('--out_dir',default='.',help='Output directory of collocation_YYMMDD_YYMMDD.dat in multi-window mode (%default)')
+parser.add_option('-z','--npz',default=False,action='store_true',help='Output all windows in one npz file in multi-window mode (%default)')
+parser.add_option('--npznam',default=NPZNAM,help='Output npz name (%default)')
 parser.add_option('-F','--fignam',default=FIGNAM,help='Output figure name for debug (%default)')
 parser.add_option('--vint',default=VINT,type='int',help='Verbose output interval (%default)')
 parser.add_option('-v','--verbose',default=False,action='store_true',help='Verbose mode (%default)')
@@ -47,8 +52,13 @@ if len(args) < 1:
     parser.print_help()
     sys.exit(0)
 input_fnam = args[0]
-d1 = datetime.strptime(opts.end,'%Y%m%d')
-d0 = d1-timedelta(days=opts.period)
+if opts.ends is not None:
+    ends = sorted([datetime.strptime(s.strip(),'%Y%m%d') for s in opts.ends.split(',')])
+else:
+    ends = [datetime.strptime(opts.end,'%Y%m%d')]
+windows = [(d-timedelta(days=opts.period),d) for d in ends]
+d0 = windows[0][0]
+d1 = windows[-1][1]
 
 def transform_utm_to_wgs84(easting,northing,utm_zone):
     is_northern = (1 if northing.mean() > 0 else 0)
@@ -72,50 +82,193 @@ def transform_wgs84_to_utm(longitude,latitude):
     return xyz[:,:,0],xyz[:,:,1],xyz[:,:,2] # returns easting, northing, altitude
 
 ds = gdal.Open(input_fnam)
-data = ds.ReadAsArray()
+nb = ds.RasterCount
 trans = ds.GetGeoTransform() # maybe obtained from tif_tags['ModelTransformationTag']
-indy,indx = np.indices(data[0].shape)
+indy,indx = np.indices((ds.RasterYSize,ds.RasterXSize))
 lon = trans[0]+(indx+0.5)*trans[1]+(indy+0.5)*trans[2]
 lat = trans[3]+(indx+0.5)*trans[4]+(indy+0.5)*trans[5]
 xp,yp,zp = transform_wgs84_to_utm(lon,lat)
-ds = None # close dataset
 
-tif_tags = {}
-with tifffile.TiffFile(input_fnam) as tif:
-    for tag in tif.pages[0].tags.values():
-        name,value = tag.name,tag.value
-        tif_tags[name] = value
-    #data = tif.pages[0].asarray()
-root = ET.fromstring(tif_tags['65000'])
-vh_list = []
+# Band names from GDAL descriptions (e.g. stacked VRT), or SNAP metadata
+vh_list = [ds.GetRasterBand(i+1).GetDescription() for i in range(nb)]
+if vh_list[0] == '':
+    tif_tags = {}
+    with tifffile.TiffFile(input_fnam) as tif:
+        for tag in tif.pages[0].tags.values():
+            name,value = tag.name,tag.value
+            tif_tags[name] = value
+        #data = tif.pages[0].asarray()
+    root = ET.fromstring(tif_tags['65000'])
+    vh_list = [value.text for value in root.iter('BAND_NAME')]
+nh = len(vh_list)
+if nh != nb:
+    raise ValueError('Error, nh={}, nb={}'.format(nh,nb))
+# Read only the bands in the period
 dset = []
 dtim = []
-for i,value in enumerate(root.iter('BAND_NAME')):
-    band = value.text
+for i,band in enumerate(vh_list):
     sys.stderr.write(band+'\n')
     m = re.search('_(\d+)$',band)
     if not m:
         raise ValueError('Error in finding date >>> '+band)
-    vh_list.append(band)
     dh = datetime.strptime(m.group(1),'%Y%m%d')
-    if dh < d0:
+    if dh < d0 or dh > d1:
         continue
-    if dh > d1:
-        break
-    dset.append(data[i])
+    dset.append(ds.GetRasterBand(i+1).ReadAsArray())
     dtim.append(dh)
-nh = i+1
-if nh != len(data):
-    raise ValueError('Error, nh={}, len(data)={}'.format(nh,len(data)))
+ds = None # close dataset
 dset = np.array(dset)
 dtim = np.array(dtim)
 ntim = date2num(dtim)
-t0 = ntim.min()
-t1 = ntim.max()
-nt = ntim.size
-xx = np.arange(t0,t1,0.01)
-nx = xx.size
-inds = np.arange(nx)
+
+KEYS = ['tmin','vmin','fmin','tlft','vlft','flft','trgt','vrgt','frgt','dmin','dstd','tleg','fleg','treg','freg',
+        'sstd','scor','traw','vraw','fraw','draw','rstd','rcor','bavg','bstd']
+FLAG_KEYS = ['fmin','flft','frgt','fleg','freg','fraw']
+
+def analyze(ntim,yi):
+    # Smoothed minimum and related statistics of a time series in one window
+    nt = ntim.size
+    xx = np.arange(ntim.min(),ntim.max(),0.01)
+    nx = xx.size
+    inds = np.arange(nx)
+    sp = UnivariateCubicSmoothingSpline(ntim,yi,smooth=0.05)
+    yy = sp(xx)
+    y1 = sp(ntim)
+    indx_tmin = np.argmin(yy)
+    tmin = xx[indx_tmin]
+    vmin = yy[indx_tmin]
+    fmin = (1 if indx_tmin == 0 else (2 if indx_tmin == nx-1 else 0))
+    yt = yy.copy()
+    yt[xx > tmin] = -1.0e10
+    indx_tlft = np.argmax(yt)
+    tlft = xx[indx_tlft]
+    vlft = yy[indx_tlft]
+    flft = (1 if indx_tlft == 0 else (2 if indx_tlft == nx-1 else 0))
+    yt = yy.copy()
+    yt[xx < tmin] = -1.0e10
+    indx_trgt = np.argmax(yt)
+    trgt = xx[indx_trgt]
+    vrgt = yy[indx_trgt]
+    frgt = (1 if indx_trgt == 0 else (2 if indx_trgt == nx-1 else 0))
+    dmin = vmin-splev([tmin],splrep(ntim,yi,k=1))[0]
+    dstd = np.sqrt(np.square(y1-yi).sum()/yi.size)
+    cnd0 = (yy >= vmin+dstd)
+    cnd = cnd0 & (xx < tmin)
+    if cnd.sum() > 0:
+        indx_tleg = inds[cnd][-1]
+        tleg = xx[indx_tleg]
+        vleg = yy[indx_tleg]
+        fleg = 0
+    else:
+        indx_tleg = 0
+        tleg = xx[indx_tleg]
+        vleg = yy[indx_tleg]
+        fleg = 1
+    cnd = cnd0 & (xx > tmin)
+    if cnd.sum() > 0:
+        indx_treg = inds[cnd][0]
+        treg = xx[indx_treg]
+        vreg = yy[indx_treg]
+        freg = 0
+    else:
+        indx_treg = nx-1
+        treg = xx[indx_treg]
+        vreg = yy[indx_treg]
+        freg = 2
+    sstd = np.std(yy)
+    scor = np.corrcoef(xx,yy)[0,1]
+    indx_traw = np.argmin(yi)
+    traw = ntim[indx_traw]
+    vraw = yi[indx_traw]
+    fraw = (1 if indx_traw == 0 else (2 if indx_traw == nt-1 else 0))
+    draw = y1[indx_traw]-vraw
+    rstd = np.std(yi)
+    rcor = np.corrcoef(ntim,yi)[0,1]
+    cnd = np.abs(ntim-tmin) > opts.sigwid
+    bavg = np.mean(yi[cnd])
+    bstd = np.std(yi[cnd])
+    return {'tmin':tmin,'vmin':vmin,'fmin':fmin,'tlft':tlft,'vlft':vlft,'flft':flft,'trgt':trgt,'vrgt':vrgt,'frgt':frgt,
+            'dmin':dmin,'dstd':dstd,'tleg':tleg,'fleg':fleg,'treg':treg,'freg':freg,'sstd':sstd,'scor':scor,
+            'traw':traw,'vraw':vraw,'fraw':fraw,'draw':draw,'rstd':rstd,'rcor':rcor,'bavg':bavg,'bstd':bstd,
+            'xx':xx,'yy':yy,'vleg':vleg,'vreg':vreg}
+
+def no_result():
+    return {key:(-1 if key in FLAG_KEYS else np.nan) for key in KEYS}
+
+def extract(shp):
+    # Time series of a field over all dates, returns (ndat, series or None, number of valid pixels per date)
+    p = Path(shp.points)
+    flags = p.contains_points(np.hstack((xp.flatten()[:,np.newaxis],yp.flatten()[:,np.newaxis]))).reshape(xp.shape)
+    ndat = flags.sum()
+    if ndat > 0:
+        dtmp = dset[:,flags].reshape(dtim.size,-1)
+        return ndat,dtmp.mean(axis=1),(~np.isnan(dtmp)).sum(axis=1)
+    pp = np.array(shp.points)
+    xc = pp[:,0].mean()
+    yc = pp[:,1].mean()
+    if p.contains_point((xc,yc)):
+        dp = np.square(xp-xc)+np.square(yp-yc)
+        indx_y,indx_x = np.unravel_index(np.argmin(dp),xp.shape)
+        dp_min = np.sqrt(dp[indx_y,indx_x])
+        if dp_min < opts.maxdis:
+            return -1,dset[:,indx_y,indx_x],None
+        else:
+            sys.stderr.write('Case A, x={}, y={}, dp_min={}\n'.format(indx_x,indx_y,dp_min))
+    else:
+        dp_min = 1.0e10
+        indx_y = None
+        indx_x = None
+        for ip in range(len(pp)):
+            xc = pp[ip,0]
+            yc = pp[ip,1]
+            dp = np.square(xp-xc)+np.square(yp-yc)
+            iy,ix = np.unravel_index(np.argmin(dp),xp.shape)
+            dp_tmp = dp[iy,ix]
+            if dp_tmp < dp_min:
+                indx_y = iy
+                indx_x = ix
+                dp_min = dp_tmp
+        dp_min = np.sqrt(dp_min)
+        if dp_min < opts.maxdis:
+            return -2,dset[:,indx_y,indx_x],None
+        else:
+            sys.stderr.write('Case B, x={}, y={}, dp_min={}\n'.format(indx_x,indx_y,dp_min))
+    return ndat,None,None
+
+def write_header(fp,t0,t1,nt):
+    fp.write('# {:.5f} {:.5f} {:4d}\n'.format(t0,t1,nt))
+    fp.write('# {:>5s} {:>4s} '.format('i','ndat'))
+    fp.write('{:>11s} {:>11s} {:>4s} '.format('tmin','vmin','fmin'))
+    fp.write('{:>11s} {:>11s} {:>4s} '.format('tlft','vlft','flft'))
+    fp.write('{:>11s} {:>11s} {:>4s} '.format('trgt','vrgt','frgt'))
+    fp.write('{:>13s} {:>13s} '.format('dmin','dstd'))
+    fp.write('{:>9s} {:>4s} '.format('tleg','fleg'))
+    fp.write('{:>9s} {:>4s} '.format('treg','freg'))
+    fp.write('{:>13s} {:>13s} '.format('sstd','scor'))
+    fp.write('{:>11s} {:>11s} {:>4s} '.format('traw','vraw','fraw'))
+    fp.write('{:>13s} {:>13s} {:>13s} '.format('draw','rstd','rcor'))
+    fp.write('{:>13s} {:>13s}\n'.format('bavg','bstd'))
+
+def write_line(fp,i,ndat,r):
+    fp.write('{:8d} {:3d} '.format(i,ndat))
+    fp.write('{:11.3f} {:13.6e} {:2d} '.format(r['tmin'],r['vmin'],r['fmin']))
+    fp.write('{:11.3f} {:13.6e} {:2d} '.format(r['tlft'],r['vlft'],r['flft']))
+    fp.write('{:11.3f} {:13.6e} {:2d} '.format(r['trgt'],r['vrgt'],r['frgt']))
+    fp.write('{:13.6e} {:13.6e} '.format(r['dmin'],r['dstd']))
+    fp.write('{:11.3f} {:2d} '.format(r['tleg'],r['fleg']))
+    fp.write('{:11.3f} {:2d} '.format(r['treg'],r['freg']))
+    fp.write('{:13.6e} {:13.6e} '.format(r['sstd'],r['scor']))
+    fp.write('{:11.3f} {:13.6e} {:2d} '.format(r['traw'],r['vraw'],r['fraw']))
+    fp.write('{:13.6e} {:13.6e} {:13.6e} '.format(r['draw'],r['rstd'],r['rcor']))
+    fp.write('{:13.6e} {:13.6e}\n'.format(r['bavg'],r['bstd']))
+
+# Dates in each window
+tinds = []
+for w0,w1 in windows:
+    tind = np.where((dtim >= w0) & (dtim <= w1))[0]
+    if tind.size < 1:
+        raise ValueError('Error, no data between {:%Y%m%d} and {:%Y%m%d}'.format(w0,w1))
+    tinds.append(tind)
 
 if opts.debug:
     plt.interactive(False)
@@ -168,171 +321,50 @@ elif opts.ind is not None:
     indi = opts.ind
 else:
     indi = range(len(r))
-with open(opts.datnam,'w') as fp:
-    fp.write('# {:.5f} {:.5f} {:4d}\n'.format(t0,t1,nt))
-    fp.write('# {:>5s} {:>4s} '.format('i','ndat'))
-    fp.write('{:>11s} {:>11s} {:>4s} '.format('tmin','vmin','fmin'))
-    fp.write('{:>11s} {:>11s} {:>4s} '.format('tlft','vlft','flft'))
-    fp.write('{:>11s} {:>11s} {:>4s} '.format('trgt','vrgt','frgt'))
-    fp.write('{:>13s} {:>13s} '.format('dmin','dstd'))
-    fp.write('{:>9s} {:>4s} '.format('tleg','fleg'))
-    fp.write('{:>9s} {:>4s} '.format('treg','freg'))
-    fp.write('{:>13s} {:>13s} '.format('sstd','scor'))
-    fp.write('{:>11s} {:>11s} {:>4s} '.format('traw','vraw','fraw'))
-    fp.write('{:>13s} {:>13s} {:>13s} '.format('draw','rstd','rcor'))
-    fp.write('{:>13s} {:>13s}\n'.format('bavg','bstd'))
-    for inum,i in enumerate(indi):
-        if opts.verbose and inum%opts.vint == 0:
-            sys.stderr.write('{} {}\n'.format(inum,len(indi)))
-        shp = r.shape(i)
-        p = Path(shp.points)
-        flags = p.contains_points(np.hstack((xp.flatten()[:,np.newaxis],yp.flatten()[:,np.newaxis]))).reshape(dset[0].shape)
-        ndat = flags.sum()
-        tmin = np.nan
-        vmin = np.nan
-        fmin = -1
-        tlft = np.nan
-        vlft = np.nan
-        flft = -1
-        trgt = np.nan
-        vrgt = np.nan
-        frgt = -1
-        dmin = np.nan
-        dstd = np.nan
-        tleg = np.nan
-        fleg = -1
-        treg = np.nan
-        freg = -1
-        sstd = np.nan
-        scor = np.nan
-        traw = np.nan
-        vraw = np.nan
-        fraw = -1
-        draw = np.nan
-        rstd = np.nan
-        rcor = np.nan
-        bavg = np.nan
-        bstd = np.nan
+
+# Output files, one per window (or one npz for all windows)
+fps = []
+if opts.ends is None:
+    fps.append(open(opts.datnam,'w'))
+elif not opts.npz:
+    for w0,w1 in windows:
+        fps.append(open(os.path.join(opts.out_dir,'collocation_{:%y%m%d}_{:%y%m%d}.dat'.format(w0,w1)),'w'))
+for fp,tind in zip(fps,tinds):
+    write_header(fp,ntim[tind].min(),ntim[tind].max(),tind.size)
+results = [{key:[] for key in ['j','ndat']+KEYS} for w in windows]
+for inum,i in enumerate(indi):
+    if opts.verbose and inum%opts.vint == 0:
+        sys.stderr.write('{} {}\n'.format(inum,len(indi)))
+    ndat,yall,nvalid = extract(r.shape(i))
+    for iw,tind in enumerate(tinds):
+        result = no_result()
         yi = None
-        if ndat > 0:
-            dtmp = dset[0][flags]
-            cnd = ~np.isnan(dtmp)
-            if cnd.sum() > 0:
-                yi = dset[:,flags].reshape(dtim.size,-1).mean(axis=1)
+        if yall is not None and (nvalid is None or nvalid[tind[0]] > 0):
+            yi = yall[tind]
+            result = analyze(ntim[tind],yi)
+        if len(fps) > 0:
+            write_line(fps[iw],i,ndat,result)
         else:
-            pp = np.array(shp.points)
-            xc = pp[:,0].mean()
-            yc = pp[:,1].mean()
-            if p.contains_point((xc,yc)):
-                dp = np.square(xp-xc)+np.square(yp-yc)
-                indx_y,indx_x = np.unravel_index(np.argmin(dp),xp.shape)
-                dp_min = np.sqrt(dp[indx_y,indx_x])
-                if dp_min < opts.maxdis:
-                    yi = dset[:,indx_y,indx_x]
-                    ndat = -1
-                else:
-                    sys.stderr.write('Case A, x={}, y={}, dp_min={}\n'.format(indx_x,indx_y,dp_min))
-            else:
-                dp_min = 1.0e10
-                indx_y = None
-                indx_x = None
-                for ip in range(len(pp)):
-                    xc = pp[ip,0]
-                    yc = pp[ip,1]
-                    dp = np.square(xp-xc)+np.square(yp-yc)
-                    iy,ix = np.unravel_index(np.argmin(dp),xp.shape)
-                    dp_tmp = dp[iy,ix]
-                    if dp_tmp < dp_min:
-                        indx_y = iy
-                        indx_x = ix
-                        dp_min = dp_tmp
-                dp_min = np.sqrt(dp_min)
-                if dp_min < opts.maxdis:
-                    yi = dset[:,indx_y,indx_x]
-                    ndat = -2
-                else:
-                    sys.stderr.write('Case B, x={}, y={}, dp_min={}\n'.format(indx_x,indx_y,dp_min))
-        if yi is not None:
-            sp = UnivariateCubicSmoothingSpline(ntim,yi,smooth=0.05)
-            yy = sp(xx)
-            y1 = sp(ntim)
-            indx_tmin = np.argmin(yy)
-            tmin = xx[indx_tmin]
-            vmin = yy[indx_tmin]
-            fmin = (1 if indx_tmin == 0 else (2 if indx_tmin == nx-1 else 0))
-            yt = yy.copy()
-            yt[xx > tmin] = -1.0e10
-            indx_tlft = np.argmax(yt)
-            tlft = xx[indx_tlft]
-            vlft = yy[indx_tlft]
-            flft = (1 if indx_tlft == 0 else (2 if indx_tlft == nx-1 else 0))
-            yt = yy.copy()
-            yt[xx < tmin] = -1.0e10
-            indx_trgt = np.argmax(yt)
-            trgt = xx[indx_trgt]
-            vrgt = yy[indx_trgt]
-            frgt = (1 if indx_trgt == 0 else (2 if indx_trgt == nx-1 else 0))
-            dmin = vmin-splev([tmin],splrep(ntim,yi,k=1))[0]
-            dstd = np.sqrt(np.square(y1-yi).sum()/yi.size)
-            cnd0 = (yy >= vmin+dstd)
-            cnd = cnd0 & (xx < tmin)
-            if cnd.sum() > 0:
-                indx_tleg = inds[cnd][-1]
-                tleg = xx[indx_tleg]
-                vleg = yy[indx_tleg]
-                fleg = 0
-            else:
-                indx_tleg = 0
-                tleg = xx[indx_tleg]
-                vleg = yy[indx_tleg]
-                fleg = 1
-            cnd = cnd0 & (xx > tmin)
-            if cnd.sum() > 0:
-                indx_treg = inds[cnd][0]
-                treg = xx[indx_treg]
-                vreg = yy[indx_treg]
-                freg = 0
-            else:
-                indx_treg = nx-1
-                treg = xx[indx_treg]
-                vreg = yy[indx_treg]
-                freg = 2
-            sstd = np.std(yy)
-            scor = np.corrcoef(xx,yy)[0,1]
-            indx_traw = np.argmin(yi)
-            traw = ntim[indx_traw]
-            vraw = yi[indx_traw]
-            fraw = (1 if indx_traw == 0 else (2 if indx_traw == nt-1 else 0))
-            draw = y1[indx_traw]-vraw
-            rstd = np.std(yi)
-            rcor = np.corrcoef(ntim,yi)[0,1]
-            cnd = np.abs(ntim-tmin) > opts.sigwid
-            bavg = np.mean(yi[cnd])
-            bstd = np.std(yi[cnd])
-        fp.write('{:8d} {:3d} '.format(i,ndat))
-        fp.write('{:11.3f} {:13.6e} {:2d} '.format(tmin,vmin,fmin))
-        fp.write('{:11.3f} {:13.6e} {:2d} '.format(tlft,vlft,flft))
-        fp.write('{:11.3f} {:13.6e} {:2d} '.format(trgt,vrgt,frgt))
-        fp.write('{:13.6e} {:13.6e} '.format(dmin,dstd))
-        fp.write('{:11.3f} {:2d} '.format(tleg,fleg))
-        fp.write('{:11.3f} {:2d} '.format(treg,freg))
-        fp.write('{:13.6e} {:13.6e} '.format(sstd,scor))
-        fp.write('{:11.3f} {:13.6e} {:2d} '.format(traw,vraw,fraw))
-        fp.write('{:13.6e} {:13.6e} {:13.6e} '.format(draw,rstd,rcor))
-        fp.write('{:13.6e} {:13.6e}\n'.format(bavg,bstd))
-        if opts.debug and not np.isnan(tmin):
+            results[iw]['j'].append(i)
+            results[iw]['ndat'].append(ndat)
+            for key in KEYS:
+                results[iw][key].append(result[key])
+        if opts.debug and not np.isnan(result['tmin']):
+            tmin,vmin,dmin,traw,vraw,draw = [result[key] for key in ['tmin','vmin','dmin','traw','vraw','draw']]
+            tlft,vlft,trgt,vrgt,tleg,treg = [result[key] for key in ['tlft','vlft','trgt','vrgt','tleg','treg']]
+            dstd,bstd,bavg,fleg,freg = [result[key] for key in ['dstd','bstd','bavg','fleg','freg']]
             fig.clear()
             ax1 = plt.subplot(111)
-            ax1.plot(ntim,yi,'b-')
-            ax1.plot(xx,yy,'r-')
+            ax1.plot(ntim[tind],yi,'b-')
+            ax1.plot(result['xx'],result['yy'],'r-')
             ax1.axhline(bavg,color='c')
             ax1.plot(tmin,vmin-dmin,'g^')
             ax1.plot(traw,vraw+draw,'gv')
             ax1.plot(tmin,vmin,'bo')
             ax1.plot(tlft,vlft,'m<')
             ax1.plot(trgt,vrgt,'m>')
-            ax1.plot(tleg,vleg,'c<')
-            ax1.plot(treg,vreg,'c>')
+            ax1.plot(tleg,result['vleg'],'c<')
+            ax1.plot(treg,result['vreg'],'c>')
             ax1.set_ylim(-30.0,-10.0)
             if opts.trans_date is not None:
                 ax1.axvline(date2num(pdat[inum]),color='k')
@@ -351,6 +383,14 @@ with open(opts.datnam,'w') as fp:
                                                                                                 freg,('$^{*}$' if freg != 0 else '')))
             plt.draw()
             plt.savefig(pdf,format='pdf')
-        #break
+    #break
+for fp in fps:
+    fp.close()
+if len(fps) < 1:
+    # Stacked output, arrays of (number of windows, number of fields)
+    np.savez(opts.npznam,d0=np.array(['{:%Y%m%d}'.format(w0) for w0,w1 in windows]),
+             d1=np.array(['{:%Y%m%d}'.format(w1) for w0,w1 in windows]),
+             t0=np.array([ntim[tind].min() for tind in tinds]),t1=np.array([ntim[tind].max() for tind in tinds]),
+             nt=np.array([tind.size for tind in tinds]),**{key:np.array([res[key] for res in results]) for key in ['j','ndat']+KEYS})
 if opts.debug:
     pdf.close()
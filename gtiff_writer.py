@@ -0,0 +1,98 @@
+import os
+import tempfile
+import numpy as np
+import gdal
+import osr
+
+# Default values
+COMPRESS = 'DEFLATE'
+PREDICTOR = 3 # floating point predictor, use 2 for integer data
+BLOCKSIZE = 512
+RESAMPLING = 'AVERAGE'
+
+def get_srs(epsg=None,prj=None):
+    # Projection in WKT from an EPSG code or a WKT string
+    if prj is not None:
+        return prj
+    if epsg is None:
+        raise ValueError('Error, epsg or prj must be given.')
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(epsg)
+    return srs.ExportToWkt()
+
+class GTiffWriter:
+    # Cloud-optimized GeoTIFF writer.
+    # Data are written band by band or block by block (write(data,iband,xoff,yoff)) into a tiled
+    # temporary file, which is converted to the output with internal overviews on close().
+    def __init__(self,fnam,nx,ny,nband,trans,epsg=None,prj=None,band_name=None,nodata=np.nan,dtype=gdal.GDT_Float32,
+                 compress=COMPRESS,predictor=PREDICTOR,blocksize=BLOCKSIZE,overviews=True,resampling=RESAMPLING,metadata=None):
+        self.fnam = fnam
+        self.nband = nband
+        self.compress = compress
+        self.predictor = predictor
+        self.blocksize = blocksize
+        self.overviews = overviews
+        self.resampling = resampling
+        dnam = os.path.dirname(os.path.abspath(fnam))
+        fd,self.tmpnam = tempfile.mkstemp(prefix='.tmp_',suffix='.tif',dir=dnam)
+        os.close(fd)
+        drv = gdal.GetDriverByName('GTiff')
+        self.ds = drv.Create(self.tmpnam,nx,ny,nband,dtype,['TILED=YES','BLOCKXSIZE={}'.format(blocksize),'BLOCKYSIZE={}'.format(blocksize),'BIGTIFF=IF_SAFER'])
+        self.ds.SetGeoTransform(trans)
+        self.ds.SetProjection(get_srs(epsg,prj))
+        if metadata is not None:
+            self.ds.SetMetadata(metadata)
+        for i in range(nband):
+            band = self.ds.GetRasterBand(i+1)
+            if band_name is not None:
+                band.SetDescription(band_name[i])
+            if nodata is not None:
+                band.SetNoDataValue(nodata)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,exc_type,exc_value,traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.ds = None
+            os.remove(self.tmpnam)
+
+    def write(self,data,iband=None,xoff=0,yoff=0):
+        # data: 2D array for band iband (0-based), or 3D array (nband,ny,nx) if iband is None
+        if iband is None:
+            for i in range(self.nband):
+                self.ds.GetRasterBand(i+1).WriteArray(data[i],xoff,yoff)
+        else:
+            self.ds.GetRasterBand(iband+1).WriteArray(data,xoff,yoff)
+
+    def close(self):
+        options = ['COMPRESS={}'.format(self.compress),'NUM_THREADS=ALL_CPUS','BIGTIFF=IF_SAFER']
+        if self.predictor is not None and self.compress.upper() in ['LZW','DEFLATE','ZSTD']:
+            options.append('PREDICTOR={}'.format(self.predictor))
+        if gdal.GetDriverByName('COG') is not None: # GDAL >= 3.1
+            options.extend(['BLOCKSIZE={}'.format(self.blocksize),'RESAMPLING={}'.format(self.resampling),
+                            'OVERVIEWS={}'.format('AUTO' if self.overviews else 'NONE')])
+            self.ds.FlushCache()
+            gdal.Translate(self.fnam,self.ds,format='COG',creationOptions=options)
+        else: # tiled GeoTIFF with the overviews copied ahead of the image data
+            if self.overviews:
+                levels = []
+                n = 2
+                while max(self.ds.RasterXSize,self.ds.RasterYSize)/n >= self.blocksize/2:
+                    levels.append(n)
+                    n *= 2
+                if len(levels) > 0:
+                    self.ds.BuildOverviews(self.resampling,levels)
+            options.extend(['TILED=YES','BLOCKXSIZE={}'.format(self.blocksize),'BLOCKYSIZE={}'.format(self.blocksize),'COPY_SRC_OVERVIEWS=YES'])
+            self.ds.FlushCache()
+            gdal.Translate(self.fnam,self.ds,format='GTiff',creationOptions=options)
+        self.ds = None # close dataset
+        os.remove(self.tmpnam)
+
+def write_tiff(fnam,data,trans,epsg=None,prj=None,band_name=None,**kwargs):
+    # Write a 3D array (nband,ny,nx) at once
+    nband,ny,nx = data.shape
+    with GTiffWriter(fnam,nx,ny,nband,trans,epsg=epsg,prj=prj,band_name=band_name,**kwargs) as w:
+        w.write(data)
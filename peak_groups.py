@@ -0,0 +1,26 @@
+import numpy as np
+
+def sort_peaks(sid,xpek,ngrd):
+    # Sort peaks by (cell, time) into CSR arrays, ties keep the input order.
+    # Returns the sort indices and the pointers (peaks of cell i are in [ptr[i],ptr[i+1]))
+    indx = np.lexsort((xpek,sid))
+    ptr = np.zeros(ngrd+1,dtype=np.int64)
+    ptr[1:] = np.cumsum(np.bincount(sid,minlength=ngrd))
+    return indx,ptr
+
+def search_segments(xs,start,end,x,side='left'):
+    # np.searchsorted(xs[start:end],x,side)+start for each segment of a CSR array
+    lo = start.copy()
+    hi = end.copy()
+    while True:
+        cnd = (lo < hi)
+        if not cnd.any():
+            return lo
+        mid = (lo+hi)//2
+        flag = np.zeros(lo.size,dtype=bool)
+        if side == 'left':
+            flag[cnd] = (xs[mid[cnd]] < x[cnd])
+        else:
+            flag[cnd] = (xs[mid[cnd]] <= x[cnd])
+        lo = np.where(cnd & flag,mid+1,lo)
+        hi = np.where(cnd & ~flag,mid,hi)
@@ -2,20 +2,30 @@
 import os
 import sys
 import re
+import shlex
+import time
 import shutil
-import zipfile
-from glob import glob
+import threading
 from datetime import datetime,timedelta
 import numpy as np
 from subprocess import call
+from concurrent.futures import ThreadPoolExecutor
+from snap_server import run_job
+from snap_cache import ScopedCache
+from archive_index import INDEX,S1_PATTERN,ArchiveIndex
 from optparse import OptionParser,IndentedHelpFormatter
 
 # Default values
 DATDIR = '.'
+WORKERS = 1
+MEM_FRACTION = 0.8
+STAGGER = 30.0 # sec
 
 # Read options
 parser = OptionParser(formatter=IndentedHelpFormatter(max_help_position=200,width=200))
 parser.add_option('-D','--datdir',default=DATDIR,help='Sentinel-1 data directory (%default)')
+parser.add_option('--index',default=None,help='Archive index file (DATDIR/{})'.format(INDEX))
+parser.add_option('--rescan',default=False,action='store_true',help='Scan the archive ignoring the directory times in the index (%default)')
 parser.add_option('-s','--start',default=None,help='Start date of the query in the format YYYYMMDD.')
 parser.add_option('-e','--end',default=None,help='End date of the query in the format YYYYMMDD.')
 parser.add_option('-g','--gamma0',default=False,action='store_true',help='Output gamma0 instead of sigma0 (%default)')
@@ -25,45 +35,110 @@ parser.add_option('--iangle_value',default=False,action='store_true',help='Outpu
 parser.add_option('--iangle_image',default=False,action='store_true',help='Output incidence angle image (%default)')
 parser.add_option('-S','--std_grid',default=False,action='store_true',help='Use standard grid (%default)')
 parser.add_option('-T','--tiff',default=False,action='store_true',help='GeoTiff mode (%default)')
+parser.add_option('--graph',default=False,action='store_true',help='Run sentinel1_preprocess.py in gpt graph mode (%default)')
+parser.add_option('-n','--workers',default=WORKERS,type='int',help='Number of scenes processed concurrently (%default)')
+parser.add_option('--mem_fraction',default=MEM_FRACTION,type='float',help='Fraction of total memory shared by the workers (%default)')
+parser.add_option('--heap_size',default=None,type='int',help='Java heap size per worker in MB (total memory*mem_fraction/workers if workers > 1)')
+parser.add_option('--stagger',default=STAGGER,type='float',help='Minimum interval between starts of workers in sec (%default)')
+parser.add_option('--cache_dir',default=None,help='Parent directory of the temporary SNAP cache of each job (system temporary directory)')
+parser.add_option('--cache_size',default=None,type='float',help='Max cache size of each job in MB, the job is terminated if exceeded (%default)')
+parser.add_option('--sweep',default=False,action='store_true',help='Also run remove_snap_cache.py when no worker is running (%default)')
+parser.add_option('--server',default=None,help='Send jobs to a running snap_server.py at this address, e.g. localhost:50007 (%default)')
 (opts,args) = parser.parse_args()
 if opts.end is None:
     opts.end = datetime.now().strftime('%Y%m%d')
 if opts.start is None:
     opts.start = (datetime.strptime(opts.end,'%Y%m%d')-timedelta(days=1)).strftime('%Y%m%d')
 
+if opts.index is None:
+    opts.index = os.path.join(opts.datdir,INDEX)
+
 dmin = datetime.strptime(opts.start,'%Y%m%d')
 dmax = datetime.strptime(opts.end,'%Y%m%d')
+if opts.heap_size is None and opts.workers > 1:
+    import psutil
+    opts.heap_size = int(psutil.virtual_memory().total*opts.mem_fraction*1.0e-6/opts.workers)
+
+lock = threading.Lock()
+nactive = 0
+tstart = 0.0
+
+def run(flag,fnam,gnam,outnam):
+    global nactive,tstart
+    command = 'sentinel1_preprocess.py'
+    command += ' '+gnam
+    if opts.gamma0:
+        command += ' --gamma0'
+    if opts.skip_orbit:
+        command += ' --skip_orbit'
+    if opts.speckle:
+        command += ' --speckle'
+    if opts.iangle_value:
+        command += ' --iangle_value'
+    if opts.iangle_image:
+        command += ' --iangle_image'
+    if opts.std_grid:
+        command += ' --std_grid'
+    if opts.tiff:
+        command += ' --tiff'
+    if opts.graph:
+        command += ' --graph'
+    if opts.heap_size is not None:
+        command += ' --heap_size {}'.format(opts.heap_size)
+    # Stagger starts so that JVMs do not initialize and read the same files at once
+    while True:
+        with lock:
+            dt = tstart+opts.stagger-time.time()
+            if dt <= 0.0 or nactive == 0:
+                nactive += 1
+                tstart = time.time()
+                break
+        time.sleep(dt)
+    try:
+        if flag:
+            os.symlink(fnam,gnam)
+        sys.stderr.write('###### Start >>> {}\n'.format(outnam))
+        if opts.server is not None:
+            argv = shlex.split(command)
+            run_job(opts.server,argv[0],argv[1:])
+        else:
+            with ScopedCache(opts.cache_dir,opts.cache_size) as cache:
+                cache.call(command)
+        if flag:
+            call('rm '+gnam,shell=True)
+        if os.path.exists(outnam):
+            index.set_status(fnam,'processed')
+    finally:
+        # Sweep the global cache only when no worker is running (no worker starts while removing)
+        # Jobs not sent to a server use their own cache directory, which is removed on exit.
+        with lock:
+            nactive -= 1
+            if nactive == 0 and (opts.sweep or opts.server is not None):
+                command = 'remove_snap_cache.py'
+                call(command,shell=True)
 
+index = ArchiveIndex(opts.index,S1_PATTERN)
+outputs = set(os.listdir('.'))
+jobs = []
 for year in range(dmin.year,dmax.year+1):
     flaglist = []
     filelist = []
     datalist = []
     datelist = []
-    for f in glob(os.path.join(opts.datdir,str(year),'*.zip')):
-        fnam = os.path.basename(f)
-        m = re.search('^[^_]+_[^_]+_[^_]+_[^_]+_([^_]+)_.*.zip$',fnam)
-        if m:
-            dtim = datetime.strptime(m.group(1),'%Y%m%dT%H%M%S')
-            if dtim < dmin or dtim > dmax:
-                continue
+    for entry in index.scan(opts.datdir,year,rescan=opts.rescan):
+        f = entry['path']
+        if entry['safe'] is None or not f.endswith('.zip'):
+            continue
+        dtim = datetime.strptime(entry['dtim'],'%Y%m%dT%H%M%S')
+        if dtim < dmin or dtim > dmax:
+            continue
+        if os.path.basename(f) == entry['safe']+'.zip':
             flaglist.append(False)
             filelist.append(f)
             datalist.append(f)
             datelist.append(dtim)
         else:
-            g = None
-            dtim = None
-            z = zipfile.ZipFile(f)
-            for d in z.namelist():
-                dnam = os.path.dirname(d)
-                if re.search('^\S+\.SAFE$',dnam):
-                    m = re.search('^[^_]+_[^_]+_[^_]+_[^_]+_([^_]+)_.*.SAFE$',dnam)
-                    if m:
-                        g = os.path.splitext(dnam)[0]+'.zip'
-                        dtim = datetime.strptime(m.group(1),'%Y%m%dT%H%M%S')
-                        break
-            if g is None:
-                continue
+            g = entry['safe']+'.zip'
             if not os.path.exists(g):
                 flaglist.append(True)
             else:
@@ -83,31 +158,19 @@ for year in range(dmin.year,dmax.year+1):
             outnam = '{}.tif'.format(dstr)
         else:
             outnam = '{}.dim'.format(dstr)
-        if os.path.exists(outnam):
+        if outnam in outputs:
+            if index.entries[fnam]['status'] != 'processed':
+                index.set_status(fnam,'processed',save=False)
             continue
-        command = 'sentinel1_preprocess.py'
-        command += ' '+gnam
-        if opts.gamma0:
-            command += ' --gamma0'
-        if opts.skip_orbit:
-            command += ' --skip_orbit'
-        if opts.speckle:
-            command += ' --speckle'
-        if opts.iangle_value:
-            command += ' --iangle_value'
-        if opts.iangle_image:
-            command += ' --iangle_image'
-        if opts.std_grid:
-            command += ' --std_grid'
-        if opts.tiff:
-            command += ' --tiff'
-        if flag:
-            os.symlink(fnam,gnam)
-        call(command,shell=True)
-        if flag:
-            call('rm '+gnam,shell=True)
-        # Remove cache
-        command = 'remove_snap_cache.py'
-        call(command,shell=True)
-        #break
+        jobs.append((flag,fnam,gnam,outnam))
+        outputs.add(outnam) # at most one job per output, the first scene of the date
     #break
+
+if opts.workers > 1:
+    with ThreadPoolExecutor(max_workers=opts.workers) as executor:
+        futures = [executor.submit(run,*job) for job in jobs]
+        for future in futures:
+            future.result()
+else:
+    for job in jobs:
+        run(*job)
@@ -2,12 +2,15 @@
 import os
 import sys
 import re
+import shlex
 import shutil
-import zipfile
-from glob import glob
 from datetime import datetime,timedelta
 import numpy as np
 from subprocess import call
+from snap_server import run_job
+from snap_cache import ScopedCache
+from archive_index import INDEX,S2_PATTERN,ArchiveIndex
+from sentinel2_zip import BANDS,list_members,find_members,extract_members
 from optparse import OptionParser,IndentedHelpFormatter
 
 # Default values
@@ -18,51 +21,55 @@ DT_MAX = 10 # sec
 # Read options
 parser = OptionParser(formatter=IndentedHelpFormatter(max_help_position=200,width=200))
 parser.add_option('-D','--datdir',default=DATDIR,help='Sentinel-1 data directory (%default)')
+parser.add_option('--index',default=None,help='Archive index file (DATDIR/{})'.format(INDEX))
+parser.add_option('--rescan',default=False,action='store_true',help='Scan the archive ignoring the directory times in the index (%default)')
 parser.add_option('-s','--start',default=None,help='Start date of the query in the format YYYYMMDD.')
 parser.add_option('-e','--end',default=None,help='End date of the query in the format YYYYMMDD.')
 parser.add_option('-r','--resolution',default=RESOLUTION,type='int',help='Spatial resolution in m (%default)')
 parser.add_option('-G','--geotiff',default=False,action='store_true',help='GeoTiff mode (%default)')
 parser.add_option('-m','--dt_max',default=DT_MAX,type='float',help='Max time difference in sec (%default)')
-parser.add_option('-u','--unzip',default=False,action='store_true',help='Unzip mode (%default)')
+parser.add_option('-u','--unzip',default=False,action='store_true',help='Unzip mode, extract the whole product (only the bands in --bands in native mode) (%default)')
+parser.add_option('--bands',default=','.join(BANDS),help='Bands used in unzip/native mode (%default)')
+parser.add_option('-N','--native',default=False,action='store_true',help='Subset with GDAL instead of SNAP (%default)')
+parser.add_option('--cache_dir',default=None,help='Parent directory of the temporary SNAP cache of each job (system temporary directory)')
+parser.add_option('--cache_size',default=None,type='float',help='Max cache size of each job in MB, the job is terminated if exceeded (%default)')
+parser.add_option('--sweep',default=False,action='store_true',help='Also run remove_snap_cache.py after each job (%default)')
+parser.add_option('--server',default=None,help='Send jobs to a running snap_server.py at this address, e.g. localhost:50007 (%default)')
 (opts,args) = parser.parse_args()
 if opts.end is None:
     opts.end = datetime.now().strftime('%Y%m%d')
 if opts.start is None:
     opts.start = (datetime.strptime(opts.end,'%Y%m%d')-timedelta(days=1)).strftime('%Y%m%d')
 
+if opts.index is None:
+    opts.index = os.path.join(opts.datdir,INDEX)
+
 dmin = datetime.strptime(opts.start,'%Y%m%d')
 dmax = datetime.strptime(opts.end,'%Y%m%d')
 
+index = ArchiveIndex(opts.index,S2_PATTERN)
+outputs = set(os.listdir('.'))
 for year in range(dmin.year,dmax.year+1):
     flaglist = []
     filelist = []
     datalist = []
     datelist = []
-    for f in glob(os.path.join(opts.datdir,str(year),'*.zip')):
-        fnam = os.path.basename(f)
-        m = re.search('^[^_]+_[^_]+_([^_]+)_.*.zip$',fnam)
-        if m:
-            dtim = datetime.strptime(m.group(1),'%Y%m%dT%H%M%S')
-            if dtim < dmin or dtim > dmax:
-                continue
+    for entry in index.scan(opts.datdir,year,rescan=opts.rescan):
+        f = entry['path']
+        if entry['safe'] is None:
+            if f.endswith('.SAFE'):
+                raise ValueError('Error in file name >>> '+f)
+            continue
+        dtim = datetime.strptime(entry['dtim'],'%Y%m%dT%H%M%S')
+        if dtim < dmin or dtim > dmax:
+            continue
+        if f.endswith('.SAFE') or os.path.basename(f) == entry['safe']+'.zip':
             flaglist.append(False)
             filelist.append(f)
             datalist.append(f)
             datelist.append(dtim)
         else:
-            g = None
-            dtim = None
-            z = zipfile.ZipFile(f)
-            for d in z.namelist():
-                dnam = os.path.dirname(d)
-                if re.search('^\S+\.SAFE$',dnam):
-                    m = re.search('^[^_]+_[^_]+_([^_]+)_.*.SAFE$',dnam)
-                    if m:
-                        g = os.path.splitext(dnam)[0]+'.zip'
-                        dtim = datetime.strptime(m.group(1),'%Y%m%dT%H%M%S')
-                        break
-            if g is None:
-                continue
+            g = entry['safe']+'.zip'
             if not os.path.exists(g):
                 flaglist.append(True)
             else:
@@ -70,19 +77,6 @@ for year in range(dmin.year,dmax.year+1):
             filelist.append(f)
             datalist.append(os.path.abspath(g))
             datelist.append(dtim)
-    for f in glob(os.path.join(opts.datdir,str(year),'*.SAFE')):
-        fnam = os.path.basename(f)
-        m = re.search('^[^_]+_[^_]+_([^_]+)_.*.SAFE$',fnam)
-        if m:
-            dtim = datetime.strptime(m.group(1),'%Y%m%dT%H%M%S')
-            if dtim < dmin or dtim > dmax:
-                continue
-            flaglist.append(False)
-            filelist.append(f)
-            datalist.append(f)
-            datelist.append(dtim)
-        else:
-            raise ValueError('Error in file name >>> '+f)
     flaglist = np.array(flaglist)
     filelist = np.array(filelist)
     datalist = np.array(datalist)
@@ -91,38 +85,52 @@ for year in range(dmin.year,dmax.year+1):
     for flag,fnam,gnam,dtim in zip(flaglist[indx],filelist[indx],datalist[indx],datelist[indx]):
         dstr = dtim.strftime('%Y%m%d')
         sys.stderr.write(dstr+'\n')
-        if opts.geotiff:
-            if os.path.exists('{}.tif'.format(dstr)):
-                continue
-        elif os.path.exists('{}.dim'.format(dstr)):
+        if opts.geotiff or opts.native:
+            outnam = '{}.tif'.format(dstr)
+        else:
+            outnam = '{}.dim'.format(dstr)
+        if outnam in outputs:
+            if index.entries[fnam]['status'] != 'processed':
+                index.set_status(fnam,'processed')
             continue
         unzip_flag = False
-        if opts.unzip:
-            rnam = os.path.splitext(os.path.basename(gnam))[0]+'.SAFE'
-            if not os.path.exists(rnam):
-                command = 'unzip'
-                command += ' -q'
-                command += ' '+fnam
-                call(command,shell=True)
-                unzip_flag = True
+        if opts.unzip and not os.path.isdir(fnam):
+            if opts.native: # extract only the needed bands and metadata
+                members = find_members(fnam,opts.bands.split(','))
+                rnam = extract_members(fnam,members.values(),dnam='.')
+            else: # SNAP reads every band declared in the metadata
+                rnam = extract_members(fnam,list_members(fnam),dnam='.',metadata=False)
+            unzip_flag = True
         command = 'sentinel2_subset.py'
-        if opts.unzip:
+        if unzip_flag:
             command += ' '+rnam
         else:
             command += ' '+gnam
         command += ' --resolution {}'.format(opts.resolution)
         if opts.geotiff:
             command += ' --geotiff'
+        if opts.native:
+            command += ' --native'
+            command += ' --bands '+opts.bands
         if flag:
             os.symlink(fnam,gnam)
-        call(command,shell=True)
+        if opts.server is not None:
+            argv = shlex.split(command)
+            run_job(opts.server,argv[0],argv[1:])
+        else:
+            with ScopedCache(opts.cache_dir,opts.cache_size) as cache:
+                cache.call(command)
         if unzip_flag:
-            call('rm -rf '+rnam,shell=True)
+            shutil.rmtree(os.path.dirname(rnam))
         if flag:
             call('rm '+gnam,shell=True)
-        # Remove cache
-        command = 'remove_snap_cache.py'
-        command += ' --dt_max {}'.format(opts.dt_max)
-        call(command,shell=True)
+        if os.path.exists(outnam):
+            index.set_status(fnam,'processed')
+            outputs.add(outnam) # skip other scenes/tiles of the same date
+        # Sweep the global cache, jobs not sent to a server use their own cache directory
+        if not opts.native and (opts.sweep or opts.server is not None):
+            command = 'remove_snap_cache.py'
+            command += ' --dt_max {}'.format(opts.dt_max)
+            call(command,shell=True)
         #break
     #break
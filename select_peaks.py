@@ -1,12 +1,14 @@
 #!/usr/bin/env python
 import sys
 import numpy as np
+from peak_groups import sort_peaks,search_segments
 from optparse import OptionParser,IndentedHelpFormatter
 
 # Default values
 NTHR = 5
 YTHR = 5.0 # dB
 DTHR = 10.0 # day
+NPZNAM = 'select_peaks.npz'
 
 # Read options
 parser = OptionParser(formatter=IndentedHelpFormatter(max_help_position=200,width=200))
@@ -15,6 +17,7 @@ parser.add_option('-n','--nthr',default=NTHR,type='int',help='Minimum number of
 parser.add_option('-y','--ythr',default=YTHR,type='float',help='Threshold of superposed gaussians in dB for peak selection (%default)')
 parser.add_option('-d','--dthr',default=DTHR,type='float',help='Threshold of transplanting date difference in day (%default)')
 parser.add_option('-z','--npz',default=False,action='store_true',help='NPZ mode (%default)')
+parser.add_option('-o','--outnam',default=None,help='Output file name, NPZ if it ends with .npz, otherwise text ({} in NPZ mode, stdout otherwise)'.format(NPZNAM))
 (opts,args) = parser.parse_args()
 
 if opts.npz:
@@ -62,39 +65,52 @@ if opts.ngrd is None:
     opts.ngrd = ntmp
 elif opts.ngrd != ntmp:
     sys.stderr.write('Warning, opts.ngrd={}, ntmp={}\n'.format(opts.ngrd,ntmp))
-xpek_sid = [[] for i in range(opts.ngrd)]
-ypek_sid = [[] for i in range(opts.ngrd)]
-for i,x,y in zip(sid,xpek,ypek):
-    xpek_sid[i].append(x)
-    ypek_sid[i].append(y)
-for i in range(opts.ngrd):
-    xpek_sid[i] = np.array(xpek_sid[i])
-    ypek_sid[i] = np.array(ypek_sid[i])
+if np.any(sid_0[:opts.ngrd] != np.arange(opts.ngrd)):
+    i = np.argmax(sid_0[:opts.ngrd] != np.arange(opts.ngrd))
+    raise ValueError('Error, i={}, sid_0={}'.format(i,sid_0[i]))
+if opts.outnam is None and opts.npz:
+    opts.outnam = NPZNAM
 
-for i in range(opts.ngrd):
-    if i != sid_0[i]:
-        raise ValueError('Error, i={}, sid_0={}'.format(i,sid_0[i]))
-    indx = np.array([sid_1[i],sid_2[i],sid_3[i],sid_4[i],sid_5[i],sid_6[i],sid_7[i],sid_8[i],sid_9[i],sid_a[i],sid_b[i],sid_c[i]])
-    for x,y in zip(xpek_sid[i],ypek_sid[i]):
-        ys = []
-        for j in indx:
-            if xpek_sid[j].size < 1:
-                continue
-            dx = np.abs(xpek_sid[j]-x)
-            k = np.argmin(dx)
-            if dx[k] < opts.dthr:
-                ys.append(ypek_sid[j][k])
-        ys = np.array(ys)
-        ns = ys.size
-        if ns > 0:
-            ymax = ys.max()
-        else:
-            ymax = 0.0
-        if y >= opts.ythr:
-            flag = True
-        elif ns >= opts.nthr and ymax >= opts.ythr:
-            flag = True
-        else:
-            flag = False
-        if flag:
-            sys.stdout.write('{:6d} {:15.8e} {:8.3f} {:6d} {:8.3f}\n'.format(i,x,y,ns,ymax))
+# Peaks of each cell sorted by time (CSR), ties keep the file order
+indx,ptr = sort_peaks(sid,xpek,opts.ngrd)
+xs = xpek[indx]
+ps = ypek[indx]
+
+# Closest peak in time of each neighbour for all peaks at once, output in the original order
+order = np.argsort(sid,kind='stable')
+sid = sid[order]
+xpek = xpek[order]
+ypek = ypek[order]
+npek = sid.size
+ns = np.zeros(npek,dtype=np.int64)
+ymax = np.full(npek,-np.inf)
+for nbr in [sid_1,sid_2,sid_3,sid_4,sid_5,sid_6,sid_7,sid_8,sid_9,sid_a,sid_b,sid_c]:
+    j = nbr[sid]
+    start = ptr[j]
+    end = ptr[j+1]
+    right = search_segments(xs,start,end,xpek)
+    left = right-1
+    cnd_l = (left >= start)
+    left[cnd_l] = search_segments(xs,start[cnd_l],end[cnd_l],xs[left[cnd_l]]) # first one of equal values
+    cnd_r = (right < end)
+    dl = np.full(npek,np.inf)
+    dr = np.full(npek,np.inf)
+    dl[cnd_l] = np.abs(xs[left[cnd_l]]-xpek[cnd_l])
+    dr[cnd_r] = np.abs(xs[right[cnd_r]]-xpek[cnd_r])
+    # Same choice as np.argmin on the peaks in the file order
+    use_l = (dl < dr)
+    tie = cnd_l & cnd_r & (dl == dr)
+    use_l[tie] = (indx[left[tie]] < indx[right[tie]])
+    k = np.where(use_l,left,right)
+    dx = np.where(use_l,dl,dr)
+    cnd = (dx < opts.dthr)
+    ns += cnd
+    ymax[cnd] = np.maximum(ymax[cnd],ps[k[cnd]])
+ymax[ns < 1] = 0.0
+flag = (ypek >= opts.ythr) | ((ns >= opts.nthr) & (ymax >= opts.ythr))
+
+if opts.outnam is not None and opts.outnam.lower().endswith('.npz'):
+    np.savez(opts.outnam,sid=sid[flag],xpek=xpek[flag],ypek=ypek[flag],ns=ns[flag],ymax=ymax[flag])
+else:
+    np.savetxt(sys.stdout if opts.outnam is None else opts.outnam,
+               np.column_stack((sid[flag],xpek[flag],ypek[flag],ns[flag],ymax[flag])),fmt='%6d %15.8e %8.3f %6d %8.3f')
@@ -1,14 +1,10 @@
 #!/usr/bin/env python
 import os
-import psutil
-mem_size = int(psutil.virtual_memory().available*0.8e-6)
-os.environ['_JAVA_OPTIONS'] = '-Xmx{}m'.format(mem_size)     # Save memory for JAVA
-os.system('export _JAVA_OPTIONS=-Xmx{}m'.format(mem_size))   # Save memory for JAVA
 import sys
 import re
 from datetime import datetime
-from snappy import Product,ProductIO,ProductUtils,GPF,HashMap,jpy
 from subprocess import call
+from snap_cache import add_java_options
 from optparse import OptionParser,IndentedHelpFormatter
 
 # Default values
@@ -22,6 +18,7 @@ parser.add_option('-F','--output_fnam',default=FNAM,help='Output tiff file name
 parser.add_option('-b','--band',default=None,type='int',action='append',help='Band# ({})'.format(BAND))
 parser.add_option('-s','--skip_rename_master',default=False,action='store_true',help='Do not rename master bands (%default)')
 parser.add_option('-S','--skip_rename_slave',default=False,action='store_true',help='Do not rename slave bands (%default)')
+parser.add_option('--snap',default=False,action='store_true',help='Always collocate with SNAP even if all inputs are on the same grid (%default)')
 (opts,args) = parser.parse_args()
 if len(args) < 2:
     parser.print_help()
@@ -30,6 +27,26 @@ fnams = args[:]
 if opts.band is None:
     opts.band = BAND
 
+# Stack with GDAL in one pass if all inputs are on the same grid
+if not opts.snap:
+    from gdal_stack import same_grid,stack_bands,get_grid,write_tiff,write_vrt
+    if same_grid(fnams):
+        # Bands are selected only when renamed, and flag bands are removed, as in the SNAP path
+        bands = stack_bands(fnams[:1],band=(None if opts.skip_rename_master else opts.band),rename=not opts.skip_rename_master,exclude='flag')
+        bands.extend(stack_bands(fnams[1:],band=(None if opts.skip_rename_slave else opts.band),rename=not opts.skip_rename_slave,exclude='flag'))
+        if os.path.splitext(opts.output_fnam)[1].lower() == '.vrt':
+            write_vrt(bands,opts.output_fnam,get_grid(fnams[0]))
+        else:
+            write_tiff(bands,opts.output_fnam,get_grid(fnams[0]))
+        sys.exit()
+    sys.stderr.write('Warning, inputs are not on the same grid, collocate with SNAP.\n')
+
+# Set memory for JAVA
+import psutil
+mem_size = int(psutil.virtual_memory().available*0.8e-6)
+add_java_options(os.environ,'-Xmx{}m'.format(mem_size))
+from snappy import Product,ProductIO,ProductUtils,GPF,HashMap,jpy
+
 # Get snappy Operators
 GPF.getDefaultInstance().getOperatorSpiRegistry().loadOperatorSpis()
 # Read original product
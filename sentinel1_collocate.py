@@ -14,6 +14,7 @@ from snappy import ProductUtils
 from snappy import HashMap
 import numpy as np
 from osgeo import gdal
+import gdal_stack
 
 # Collocation ------------------------------------------------------------------------#
 def collocate(input_img1, input_img2, write_product=False, write_fnam=None):
@@ -41,15 +42,19 @@ def collocate(input_img1, input_img2, write_product=False, write_fnam=None):
         ProductIO.writeProduct(output_img, fnam, 'BEAM-DIMAP')
     return output_img
 
-def collocate_all(input_imgs, write_product):
+def collocate_all(input_imgs, write_product, write_fnam=None):
     if len(input_imgs) < 2:
         raise ValueError('Error, len(input_imgs)={}'.format(len(input_imgs)))
+    if write_fnam is None:
+        write_fnam = "collocation_all.tif"
+    # Stack files on the same grid with GDAL in one pass, SNAP Collocate otherwise
+    if write_product and all([type(img) is str for img in input_imgs]) and gdal_stack.same_grid(input_imgs):
+        return gdal_stack.stack(input_imgs, write_fnam)
     col = collocate(input_imgs[0],input_imgs[1])
     for i in range(2,len(input_imgs)):
         col = collocate(col,input_imgs[i])
     if write_product:
-        collocation = "collocation_all.tif"
-        ProductIO.writeProduct(col, collocation, 'GeoTiff')
+        ProductIO.writeProduct(col, write_fnam, 'GeoTiff')
     return col
 
 datdir = '../2018'
@@ -1,13 +1,9 @@
 #!/usr/bin/env python
 import os
-import psutil
-mem_size = int(psutil.virtual_memory().available*0.8e-6)
-os.environ['_JAVA_OPTIONS'] = '-Xmx{}m'.format(mem_size)     # Set memory for JAVA
-os.system('export _JAVA_OPTIONS=-Xmx{}m'.format(mem_size))   # Set memory for JAVA
 import sys
 import re
 import numpy as np
-from snappy import Product,ProductIO,ProductUtils,GPF,HashMap,WKTReader,jpy
+from snap_cache import add_java_options
 from optparse import OptionParser,IndentedHelpFormatter
 
 # Defaults
@@ -15,6 +11,10 @@ ORIGIN_X = 743805.0 # pixel center
 ORIGIN_Y = 9236005.0 # pixel center
 XY_STEP = 10.0
 EPSG = 32748 # UTM zone 48S
+WKT = 'POLYGON((107.201 -6.910,107.367 -6.910,107.367 -6.760,107.201 -6.760,107.201 -6.910))' # Cihea
+GPT = 'gpt'
+TILE_SIZE = 512
+COMPRESSION = 'LZW'
 
 # Read options
 parser = OptionParser(formatter=IndentedHelpFormatter(max_help_position=200,width=200))
@@ -30,6 +30,14 @@ parser.add_option('-s','--xy_step',default=XY_STEP,type='float',help='XY step of
 parser.add_option('-E','--epsg',default=EPSG,help='Output EPSG (%default)')
 parser.add_option('-S','--std_grid',default=False,action='store_true',help='Use standard grid (%default)')
 parser.add_option('-T','--tiff',default=False,action='store_true',help='GeoTiff mode (%default)')
+parser.add_option('--heap_size',default=None,type='int',help='Java heap size in MB (80%% of available memory)')
+parser.add_option('--graph',default=False,action='store_true',help='Run the processing graph with gpt (%default)')
+parser.add_option('--gpt',default=GPT,help='gpt command in graph mode (%default)')
+parser.add_option('-q','--parallelism',default=None,type='int',help='Number of gpt threads in graph mode (SNAP default)')
+parser.add_option('-c','--cache_size',default=None,type='int',help='Tile cache size in MB in graph mode (SNAP default)')
+parser.add_option('--tile_size',default=TILE_SIZE,type='int',help='Tile size in pixel in graph mode (%default)')
+parser.add_option('--compression',default=COMPRESSION,help='GeoTiff compression in graph mode (%default)')
+parser.add_option('--timing',default=False,action='store_true',help='Report computation time per operator in graph mode (%default)')
 (opts,args) = parser.parse_args()
 if len(args) < 1:
     parser.print_help()
@@ -48,6 +56,137 @@ else:
 if os.path.exists(output_fnam):
     sys.exit()
 
+# Set memory for JAVA before starting the JVM
+if opts.heap_size is None:
+    import psutil
+    mem_size = int(psutil.virtual_memory().available*0.8e-6)
+else:
+    mem_size = opts.heap_size
+add_java_options(os.environ,'-Xmx{}m'.format(mem_size))
+
+def write_graph(graph_fnam,polarisations):
+    # Processing graph equivalent to the snappy chain below
+    import xml.etree.ElementTree as ET
+    graph = ET.Element('graph',id='sentinel1_preprocess')
+    ET.SubElement(graph,'version').text = '1.0'
+    nodes = []
+    def add_node(operator,params):
+        node = ET.SubElement(graph,'node',id='{}_{}'.format(len(nodes)+1,operator))
+        ET.SubElement(node,'operator').text = operator
+        sources = ET.SubElement(node,'sources')
+        if len(nodes) > 0:
+            ET.SubElement(sources,'sourceProduct',refid=nodes[-1])
+        parameters = ET.SubElement(node,'parameters')
+        for key,value in params:
+            if isinstance(value,ET.Element):
+                parameters.append(value)
+            else:
+                ET.SubElement(parameters,key).text = str(value).lower() if isinstance(value,bool) else str(value)
+        nodes.append(node.get('id'))
+    add_node('Read',[('file',os.path.abspath(input_fnam))])
+    if not opts.skip_orbit:
+        add_node('Apply-Orbit-File',[('continueOnFail',True)])
+    add_node('Subset',[('copyMetadata',True),('geoRegion',WKT)])
+    if opts.gamma0:
+        add_node('Calibration',[('outputSigmaBand',False),('outputBetaBand',True)])
+        add_node('Terrain-Flattening',[])
+        prefix = 'Gamma0'
+    else:
+        add_node('Calibration',[('outputSigmaBand',True)])
+        prefix = 'Sigma0'
+    if opts.speckle:
+        add_node('Speckle-Filter',[])
+    params = [('demName','SRTM 3Sec'),('demResamplingMethod','BILINEAR_INTERPOLATION'),('imgResamplingMethod','BILINEAR_INTERPOLATION'),
+              ('pixelSpacingInMeter',opts.xy_step),('mapProjection','EPSG:{}'.format(opts.epsg))]
+    if opts.iangle_image:
+        params.append(('saveIncidenceAngleFromEllipsoid',True))
+    if opts.std_grid:
+        params.extend([('alignToStandardGrid',True),('standardGridOriginX',opts.origin_x),('standardGridOriginY',opts.origin_y)])
+    add_node('Terrain-Correction',params)
+    # Convert to dB and attach date in one BandMaths node (linearToFromdB + BandSelect)
+    target_bands = ET.Element('targetBands')
+    bands = [('{}_{}_db_{}'.format(prefix,pol,dstr),'10*log10({}_{})'.format(prefix,pol)) for pol in sorted(polarisations)]
+    if opts.iangle_image:
+        bands.append(('incidenceAngleFromEllipsoid_{}'.format(dstr),'incidenceAngleFromEllipsoid'))
+    for name,expression in bands:
+        target_band = ET.SubElement(target_bands,'targetBand')
+        ET.SubElement(target_band,'name').text = name
+        ET.SubElement(target_band,'type').text = 'float32'
+        ET.SubElement(target_band,'expression').text = expression
+        ET.SubElement(target_band,'noDataValue').text = 'NaN'
+    add_node('BandMaths',[('targetBands',target_bands)])
+    add_node('Write',[('file',os.path.abspath(output_fnam)),('formatName','GeoTIFF-BigTIFF' if opts.tiff else 'BEAM-DIMAP')])
+    ET.ElementTree(graph).write(graph_fnam)
+
+def run_graph():
+    # Run the graph with gpt, tile cache/parallelism/tile size given explicitly
+    import time
+    from subprocess import Popen,PIPE,STDOUT
+    if opts.iangle_value:
+        raise ValueError('Error, --iangle_value is not supported in graph mode.')
+    m = re.search('_1S([SD])([HV])_',os.path.basename(input_fnam))
+    if not m:
+        raise ValueError('Error in polarisation >>> '+input_fnam)
+    if m.group(1) == 'D':
+        polarisations = ['HH','HV'] if m.group(2) == 'H' else ['VV','VH']
+    else:
+        polarisations = [m.group(2)*2]
+    graph_fnam = '{}_graph.xml'.format(dstr)
+    write_graph(graph_fnam,polarisations)
+    command = [opts.gpt,graph_fnam]
+    if opts.parallelism is not None:
+        command.extend(['-q','{}'.format(opts.parallelism)])
+    if opts.cache_size is not None:
+        command.extend(['-c','{}M'.format(opts.cache_size)])
+    command.append('-Dsnap.jai.defaultTileSize={}'.format(opts.tile_size))
+    if opts.tiff:
+        command.append('-Dsnap.dataio.bigtiff.compression.type={}'.format(opts.compression))
+        command.append('-Dsnap.dataio.bigtiff.tiling.width={}'.format(opts.tile_size))
+        command.append('-Dsnap.dataio.bigtiff.tiling.height={}'.format(opts.tile_size))
+    if opts.timing:
+        command.append('-Dsnap.gpf.tileComputationObserver=org.esa.snap.core.gpf.monitor.TileComputationEventLogger')
+    sys.stderr.write(' '.join(command)+'\n')
+    t1 = time.time()
+    op_times = {}
+    p = Popen(command,stdout=PIPE,stderr=STDOUT,universal_newlines=True)
+    header = None # logger line of java.util.logging, the message follows in the next line
+    for line in p.stdout:
+        if opts.timing:
+            # Only messages of TileComputationEventLogger, e.g. "INFO: ... CalibrationOp ... 123 ms"
+            # (the exact format depends on the SNAP version), all other lines are echoed
+            flag = (header is not None) or ('TileComputationEventLogger' in line)
+            m_op = re.search('(\w+)Op\\b',line)
+            m_dt = re.search('(\d+(?:\.\d+)?)\s*ms\\b',line)
+            if flag and m_op and m_dt and not re.search('WARNING|SEVERE|ERROR',line):
+                op_times[m_op.group(1)] = op_times.get(m_op.group(1),0.0)+float(m_dt.group(1))*1.0e-3
+                header = None
+                continue
+            if header is not None:
+                sys.stderr.write(header)
+                header = None
+            if 'TileComputationEventLogger' in line and not m_dt:
+                header = line
+                continue
+        sys.stderr.write(line)
+    if header is not None:
+        sys.stderr.write(header)
+    p.wait()
+    sys.stderr.write('###### gpt finished in {:.1f} sec (status {}) >>> {}\n'.format(time.time()-t1,p.returncode,output_fnam))
+    if opts.timing:
+        if len(op_times) < 1:
+            sys.stderr.write('Warning, no per-operator timing line was matched in the gpt output (the log format depends on the SNAP version), only the total time is available.\n')
+        for op in sorted(op_times,key=lambda x: op_times[x],reverse=True):
+            sys.stderr.write('{:30s} {:10.1f} sec (sum over threads)\n'.format(op,op_times[op]))
+    if p.returncode != 0:
+        sys.exit(p.returncode)
+    os.remove(graph_fnam)
+
+if opts.graph:
+    run_graph()
+    sys.exit()
+
+from snappy import Product,ProductIO,ProductUtils,GPF,HashMap,WKTReader,jpy
+
 # Get snappy Operators
 GPF.getDefaultInstance().getOperatorSpiRegistry().loadOperatorSpis()
 # Read original product
@@ -63,8 +202,7 @@ if not opts.skip_orbit:
     data = data_tmp
 # Subset (SubsetOp.java)
 WKTReader = jpy.get_type('com.vividsolutions.jts.io.WKTReader')
-wkt = "POLYGON((107.201 -6.910,107.367 -6.910,107.367 -6.760,107.201 -6.760,107.201 -6.910))"
-geom = WKTReader().read(wkt)
+geom = WKTReader().read(WKT)
 params = HashMap()
 params.put('copyMetadata',True)
 params.put('geoRegion',geom)
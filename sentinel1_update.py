@@ -6,6 +6,8 @@ import time
 from datetime import datetime,timedelta
 import numpy as np
 from subprocess import call
+from concurrent.futures import ThreadPoolExecutor
+from site_manifest import MANIFEST,Manifest
 from optparse import OptionParser,IndentedHelpFormatter
 
 # Default values
@@ -13,6 +15,8 @@ SCRDIR = '/home/naohiro/Script'
 DATDIR = '/home/naohiro/Work/Sentinel-1'
 END = datetime.now().strftime('%Y%m%d')
 SITES = ['Cihea','Bojongsoang']
+WORKERS = 4
+SITE_WORKERS = 2
 
 # Read options
 parser = OptionParser(formatter=IndentedHelpFormatter(max_help_position=200,width=200))
@@ -22,10 +26,18 @@ parser.add_option('--datdir',default=DATDIR,help='Data directory (%default)')
 parser.add_option('-s','--str',default=None,help='Start date of download in the format YYYYMMDD (%default)')
 parser.add_option('-e','--end',default=END,help='End date of download in the format YYYYMMDD (%default)')
 parser.add_option('-S','--sites',default=None,action='append',help='Target sites ({})'.format(SITES))
+parser.add_option('-n','--workers',default=WORKERS,type='int',help='Maximum number of concurrent downloads for all sites (%default)')
+parser.add_option('-N','--site_workers',default=SITE_WORKERS,type='int',help='Maximum number of concurrent downloads per site (%default)')
+parser.add_option('--slot_dir',default=None,help='Lock directory for the global download limit (DATDIR/.download_slots)')
+parser.add_option('--store',default=None,help='Product store shared by sites (DATDIR/store)')
 parser.add_option('-d','--debug',default=False,action='store_true',help='Debug mode (%default)')
 (opts,args) = parser.parse_args()
 if opts.sites is None:
     opts.sites = SITES
+if opts.slot_dir is None:
+    opts.slot_dir = os.path.join(opts.datdir,'.download_slots')
+if opts.store is None:
+    opts.store = os.path.join(opts.datdir,'store')
 
 # Determin the start date of download
 dmaxs = []
@@ -38,33 +50,19 @@ else:
         if not os.path.exists(fnam):
             raise IOError('No such file >>> '+fnam)
         datdir = os.path.join(opts.datdir,site)
-        dmax = '0'*8
-        for d in sorted(os.listdir(datdir)):
-            if not re.search('^\d\d\d\d$',d):
-                continue
-            dnam = os.path.join(datdir,d)
-            if not os.path.isdir(dnam):
-                continue
-            for f in sorted(os.listdir(dnam)):
-                #S1A_IW_GRDH_1SDV_20171227T223338_20171227T223405_019894_021DC8_434F.zip
-                #S1B_IW_GRDH_1SDV_20200116T223300_20200116T223336_019848_025883_2DEF.zip
-                m = re.search('^S1[AB]_IW_GRDH_1SDV_('+'\d'*8+')T\S+\.zip$',f)
-                if not m:
-                    continue
-                dstr = m.group(1)
-                if dstr > dmax:
-                    dmax = dstr
-        if dmax == '0'*8:
+        manifest = Manifest(os.path.join(datdir,MANIFEST))
+        if len(manifest.products) < 1: # build the manifest from the archive only once
+            manifest.scan(datdir)
+        dmax = manifest.latest()
+        if dmax is None:
             raise ValueError('Error in determining the start date of download >>> '+site)
         dmaxs.append((datetime.strptime(dmax,'%Y%m%d')+timedelta(days=1)).strftime('%Y%m%d'))
 if len(dmaxs) != len(opts.sites):
     raise ValueError('Error, len(dmaxs)={}, len(opts.sites)={}'.format(len(dmaxs),len(opts.sites)))
 
 # Download data
-topdir = os.getcwd()
-for site,start in zip(opts.sites,dmaxs):
+def update_site(site,start):
     datdir = os.path.join(opts.datdir,site)
-    os.chdir(datdir)
     command = 'python'
     command += ' '+os.path.join(opts.scrdir,'sentinel_download.py')
     command += ' -g '+os.path.join(opts.scrdir,site.lower()+'.json')
@@ -72,9 +70,13 @@ for site,start in zip(opts.sites,dmaxs):
     command += ' -s '+start
     command += ' -e '+opts.end
     command += ' -d'
+    command += ' --workers {}'.format(opts.site_workers)
+    command += ' --slot_dir '+opts.slot_dir
+    command += ' --slots {}'.format(opts.workers)
+    command += ' --manifest '+MANIFEST
+    command += ' --store '+opts.store
     print(command)
-    call(command,shell=True)
-    os.chdir(topdir)
+    call(command,shell=True,cwd=datdir)
     for f in sorted(os.listdir(datdir)):
         #S1A_IW_GRDH_1SDV_20171227T223338_20171227T223405_019894_021DC8_434F.zip
         #S1B_IW_GRDH_1SDV_20200116T223300_20200116T223336_019848_025883_2DEF.zip
@@ -84,4 +86,10 @@ for site,start in zip(opts.sites,dmaxs):
         year = m.group(1)
         fnam = os.path.join(datdir,f)
         gnam = os.path.join(datdir,year,f)
+        if not os.path.isdir(os.path.dirname(gnam)):
+            os.makedirs(os.path.dirname(gnam))
         os.rename(fnam,gnam)
+
+# Sites are updated concurrently, the global limit is shared through the lock files in opts.slot_dir
+with ThreadPoolExecutor(max_workers=len(opts.sites)) as executor:
+    list(executor.map(update_site,opts.sites,dmaxs))
@@ -1,21 +1,23 @@
 #!/usr/bin/env python
 import os
-import psutil
-mem_size = int(psutil.virtual_memory().available*0.8e-6)
-os.environ['_JAVA_OPTIONS'] = '-Xmx{}m'.format(mem_size)     # Save memory for JAVA
-os.system('export _JAVA_OPTIONS=-Xmx{}m'.format(mem_size))   # Save memory for JAVA
 import sys
 import re
-from snappy import Product,ProductIO,ProductUtils,GPF,HashMap,WKTReader,jpy
+from snap_cache import add_java_options
 from optparse import OptionParser,IndentedHelpFormatter
 
 # Default values
 RESOLUTION = 10 # m
+BANDS = 'B04,B08,SCL'
+WKT = 'POLYGON((107.201 -6.910,107.367 -6.910,107.367 -6.750,107.201 -6.750,107.201 -6.910))' # Cihea
+#WKT = 'POLYGON((107.54 -7.04,107.75 -7.04,107.75 -6.95,107.54 -6.95,107.54 -7.04))' # Bojongsoang
 
 # Read options
 parser = OptionParser(formatter=IndentedHelpFormatter(max_help_position=200,width=200))
 parser.add_option('-r','--resolution',default=RESOLUTION,type='int',help='Spatial resolution in m (%default)')
 parser.add_option('-G','--geotiff',default=False,action='store_true',help='GeoTiff mode (%default)')
+parser.add_option('-N','--native',default=False,action='store_true',help='Read the AOI window with GDAL instead of SNAP, always in GeoTiff (%default)')
+parser.add_option('-b','--bands',default=BANDS,help='Output bands in native mode (%default)')
+parser.add_option('-w','--wkt',default=WKT,help='Subset region in WKT (%default)')
 parser.set_usage('Usage: %prog input_fnam [options]')
 (opts,args) = parser.parse_args()
 if len(args) < 1:
@@ -30,13 +32,103 @@ if not m:
         raise ValueError('Error in file name >>> '+input_fnam)
     safe_flag = True
 dstr = m.group(1)[:8]
-if opts.geotiff:
+if opts.geotiff or opts.native:
     output_fnam = '{}.tif'.format(dstr)
 else:
     output_fnam = '{}.dim'.format(dstr)
 if os.path.exists(output_fnam):
     sys.exit()
 
+def subset_native():
+    # Read only the AOI window of each band and resample to the output grid
+    import shutil
+    import numpy as np
+    import xml.etree.ElementTree as ET
+    import gdal
+    import ogr
+    import osr
+    from sentinel2_zip import BAND_NUMBERS,open_bands,read_member
+    bands = [band.strip() for band in opts.bands.split(',')]
+    datasets,safe_dir = open_bands(input_fnam,bands,dnam='.')
+    # Reflectance = (DN+offset)/quantification
+    root = ET.fromstring(read_member(input_fnam,'MTD_MSIL2A\.xml$'))
+    quant = 10000.0
+    for value in root.iter('BOA_QUANTIFICATION_VALUE'):
+        quant = float(value.text)
+    offsets = {}
+    for value in root.iter('BOA_ADD_OFFSET'): # processing baseline 04.00 or later
+        offsets[int(value.get('band_id'))] = float(value.text)
+    band_ids = ['B01','B02','B03','B04','B05','B06','B07','B08','B8A','B09','B10','B11','B12']
+    # Output grid aligned to the tile origin
+    ds = datasets[bands[0]]
+    prj = ds.GetProjection()
+    trans = ds.GetGeoTransform()
+    srs = osr.SpatialReference(wkt=prj)
+    srs_geo = osr.SpatialReference()
+    srs_geo.ImportFromEPSG(4326)
+    if hasattr(osr,'OAMS_TRADITIONAL_GIS_ORDER'): # GDAL>=3
+        srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+        srs_geo.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+    geom = ogr.CreateGeometryFromWkt(opts.wkt)
+    geom.Segmentize(0.001)
+    geom.Transform(osr.CoordinateTransformation(srs_geo,srs))
+    xmin,xmax,ymin,ymax = geom.GetEnvelope()
+    res = float(opts.resolution)
+    nx_tile = int(ds.RasterXSize*trans[1]/res)
+    ny_tile = int(ds.RasterYSize*abs(trans[5])/res)
+    ix1 = max(int(np.floor((xmin-trans[0])/res)),0)
+    ix2 = min(int(np.ceil((xmax-trans[0])/res)),nx_tile)
+    iy1 = max(int(np.floor((trans[3]-ymax)/res)),0)
+    iy2 = min(int(np.ceil((trans[3]-ymin)/res)),ny_tile)
+    nx = ix2-ix1
+    ny = iy2-iy1
+    if nx < 1 or ny < 1:
+        raise ValueError('Error, no overlap with the region >>> '+input_fnam)
+    bounds = (trans[0]+ix1*res,trans[3]-iy2*res,trans[0]+ix2*res,trans[3]-iy1*res)
+    drv = gdal.GetDriverByName('GTiff')
+    ds_out = drv.Create(output_fnam,nx,ny,len(bands),gdal.GDT_Float32,['COMPRESS=LZW','TILED=YES'])
+    ds_out.SetGeoTransform((bounds[0],res,0.0,bounds[3],0.0,-res))
+    ds_out.SetProjection(prj)
+    for i,band in enumerate(bands):
+        ds = datasets[band]
+        step = ds.GetGeoTransform()[1]
+        if step == res:
+            dset = ds.GetRasterBand(1).ReadAsArray(ix1,iy1,nx,ny).astype(np.float32)
+            if band != 'SCL':
+                dset[dset == 0] = np.nan
+        else:
+            if band == 'SCL': # class values
+                alg = 'near'
+            elif step > res:
+                alg = 'bilinear'
+            else:
+                alg = 'average'
+            ds_tmp = gdal.Warp('',ds,format='MEM',outputBounds=bounds,xRes=res,yRes=res,resampleAlg=alg,outputType=gdal.GDT_Float32,
+                               srcNodata=None if band == 'SCL' else 0,dstNodata=None if band == 'SCL' else np.nan)
+            dset = ds_tmp.GetRasterBand(1).ReadAsArray()
+            ds_tmp = None
+        if band != 'SCL':
+            dset = (dset+offsets.get(band_ids.index(band),0.0))/quant
+        band_out = ds_out.GetRasterBand(i+1)
+        band_out.WriteArray(dset)
+        band_out.SetDescription('band_{}_{}'.format(BAND_NUMBERS[band],dstr))
+    band_out.SetNoDataValue(np.nan) # The TIFFTAG_GDAL_NODATA only support one value per dataset
+    ds_out.FlushCache()
+    ds_out = None # close dataset
+    datasets = None
+    if safe_dir is not None:
+        shutil.rmtree(os.path.dirname(safe_dir))
+
+if opts.native:
+    subset_native()
+    sys.exit()
+
+# Set memory for JAVA
+import psutil
+mem_size = int(psutil.virtual_memory().available*0.8e-6)
+add_java_options(os.environ,'-Xmx{}m'.format(mem_size))
+from snappy import Product,ProductIO,ProductUtils,GPF,HashMap,WKTReader,jpy
+
 # Get snappy Operators
 GPF.getDefaultInstance().getOperatorSpiRegistry().loadOperatorSpis()
 # Read original product
@@ -54,9 +146,7 @@ data_tmp = GPF.createProduct('Resample',params,data)
 data = data_tmp
 # Subset
 WKTReader = jpy.get_type('com.vividsolutions.jts.io.WKTReader')
-wkt = "POLYGON((107.201 -6.910,107.367 -6.910,107.367 -6.750,107.201 -6.750,107.201 -6.910))" # Cihea
-#wkt = "POLYGON((107.54 -7.04,107.75 -7.04,107.75 -6.95,107.54 -6.95,107.54 -7.04))" # Bojongsoang
-geom = WKTReader().read(wkt)
+geom = WKTReader().read(opts.wkt)
 params = HashMap()
 params.put('copyMetadata',True)
 params.put('geoRegion',geom)
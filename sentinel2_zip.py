@@ -0,0 +1,101 @@
+import os
+import re
+import zipfile
+import tempfile
+import gdal
+
+# Default values
+BANDS = ['B04','B08','SCL']
+BAND_PATTERNS = {'B02':'IMG_DATA/R10m/[^/]+_B02_10m\.jp2$',
+                 'B03':'IMG_DATA/R10m/[^/]+_B03_10m\.jp2$',
+                 'B04':'IMG_DATA/R10m/[^/]+_B04_10m\.jp2$',
+                 'B08':'IMG_DATA/R10m/[^/]+_B08_10m\.jp2$',
+                 'B05':'IMG_DATA/R20m/[^/]+_B05_20m\.jp2$',
+                 'B06':'IMG_DATA/R20m/[^/]+_B06_20m\.jp2$',
+                 'B07':'IMG_DATA/R20m/[^/]+_B07_20m\.jp2$',
+                 'B8A':'IMG_DATA/R20m/[^/]+_B8A_20m\.jp2$',
+                 'B11':'IMG_DATA/R20m/[^/]+_B11_20m\.jp2$',
+                 'B12':'IMG_DATA/R20m/[^/]+_B12_20m\.jp2$',
+                 'SCL':'IMG_DATA/R20m/[^/]+_SCL_20m\.jp2$'}
+BAND_NUMBERS = {'B02':2,'B03':3,'B04':4,'B05':5,'B06':6,'B07':7,'B08':8,'B8A':9,'B11':11,'B12':12,'SCL':17} # band_names.txt
+META_PATTERN = '(\.xml|manifest\.safe)$'
+
+def list_members(fnam):
+    # Member names of a zip file, or file names relative to the parent of a .SAFE directory
+    if os.path.isdir(fnam):
+        dnam = os.path.dirname(os.path.abspath(fnam))
+        names = []
+        for root,dirs,files in os.walk(fnam):
+            for f in files:
+                names.append(os.path.relpath(os.path.join(root,f),dnam).replace(os.sep,'/'))
+        return names
+    with zipfile.ZipFile(fnam) as z:
+        return z.namelist()
+
+def find_members(fnam,bands=BANDS):
+    # Return {band: member} for the requested L2A bands
+    names = list_members(fnam)
+    members = {}
+    for band in bands:
+        for name in names:
+            if re.search(BAND_PATTERNS[band],name):
+                members[band] = name
+                break
+        else:
+            raise ValueError('Error, no such band ({}) >>> {}'.format(band,fnam))
+    return members
+
+def read_member(fnam,pattern):
+    # Contents of the first member matching pattern (e.g. MTD_MSIL2A.xml)
+    for name in list_members(fnam):
+        if re.search(pattern,name):
+            break
+    else:
+        raise ValueError('Error, no such member ({}) >>> {}'.format(pattern,fnam))
+    if os.path.isdir(fnam):
+        with open(os.path.join(os.path.dirname(os.path.abspath(fnam)),name),'rb') as fp:
+            return fp.read()
+    with zipfile.ZipFile(fnam) as z:
+        return z.read(name)
+
+def member_path(fnam,member):
+    # GDAL path of a member, read in place through /vsizip/ if fnam is a zip file
+    if os.path.isdir(fnam):
+        return os.path.join(os.path.dirname(os.path.abspath(fnam)),member)
+    return '/vsizip/'+os.path.abspath(fnam)+'/'+member
+
+def extract_members(fnam,members,dnam=None,metadata=True):
+    # Extract only the given members (and the XML metadata) to a temporary directory.
+    # Returns the path of the extracted .SAFE directory; remove its parent when done.
+    tmpdir = tempfile.mkdtemp(prefix='s2_',dir=dnam)
+    members = list(members)
+    with zipfile.ZipFile(fnam) as z:
+        names = members[:]
+        if metadata:
+            names.extend([name for name in z.namelist() if re.search(META_PATTERN,name) and name not in names])
+        for name in names:
+            z.extract(name,tmpdir)
+    return os.path.join(tmpdir,members[0].split('/')[0])
+
+def open_bands(fnam,bands=BANDS,dnam=None):
+    # Open band datasets inside the product. Members that GDAL cannot read through
+    # /vsizip/ are extracted. Returns ({band: dataset}, extracted .SAFE directory or None).
+    members = find_members(fnam,bands)
+    datasets = {}
+    for band in bands:
+        ds = gdal.Open(member_path(fnam,members[band]))
+        if ds is None:
+            break
+        datasets[band] = ds
+    else:
+        return datasets,None
+    if os.path.isdir(fnam):
+        raise IOError('Error in opening {} >>> {}'.format(members[band],fnam))
+    safe_dir = extract_members(fnam,members.values(),dnam=dnam,metadata=False)
+    datasets = {}
+    for band in bands:
+        ds = gdal.Open(os.path.join(os.path.dirname(safe_dir),members[band]))
+        if ds is None:
+            raise IOError('Error in opening {} >>> {}'.format(members[band],fnam))
+        datasets[band] = ds
+    return datasets,safe_dir
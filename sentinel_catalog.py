@@ -0,0 +1,207 @@
+import os
+import sys
+import re
+import json
+import time
+import sqlite3
+import threading
+
+# Constants
+HOME = os.environ.get('HOME')
+if HOME is None:
+    HOME = os.environ.get('HOMEPATH')
+
+# Default values
+DBNAM = os.path.join(HOME,'.cache','sentinel','catalog.db')
+QUERY_AGE = 3600 # sec
+BATCH_SIZE = 30
+TIMEOUT = 60 # sec
+
+FIELDS = ['uuid','title','size','md5','footprint','begin','url','online','checked']
+REQUEST_FIELDS = ['uuid','state','attempts','next_time','requested','message']
+
+class Catalog:
+    # Local product-metadata catalog. Search results and OData properties are stored in SQLite
+    # so that titles, sizes, checksums, footprints and online status are looked up locally.
+    def __init__(self,dbnam=DBNAM,api=None,timeout=TIMEOUT):
+        dnam = os.path.dirname(os.path.abspath(dbnam))
+        if not os.path.isdir(dnam):
+            os.makedirs(dnam)
+        self.api = api
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.con = sqlite3.connect(dbnam,timeout=timeout,check_same_thread=False)
+        self.con.execute('PRAGMA journal_mode=WAL')
+        self.con.execute('CREATE TABLE IF NOT EXISTS products (uuid TEXT PRIMARY KEY, title TEXT, size INTEGER, md5 TEXT,'
+                         ' footprint TEXT, begin TEXT, url TEXT, online INTEGER, checked REAL)')
+        self.con.execute('CREATE TABLE IF NOT EXISTS queries (qkey TEXT PRIMARY KEY, uuids TEXT, checked REAL)')
+        self.con.execute('CREATE TABLE IF NOT EXISTS requests (uuid TEXT PRIMARY KEY, state TEXT, attempts INTEGER,'
+                         ' next_time REAL, requested REAL, message TEXT)')
+        self.con.commit()
+
+    def close(self):
+        self.con.close()
+
+    def execute(self,sql,params=()):
+        with self.lock:
+            cur = self.con.execute(sql,params)
+            self.con.commit()
+        return cur
+
+    def update(self,uuid,**kwargs):
+        with self.lock:
+            self.con.execute('INSERT OR IGNORE INTO products (uuid) VALUES (?)',(uuid,))
+            if len(kwargs) > 0:
+                keys = sorted(kwargs.keys())
+                self.con.execute('UPDATE products SET {} WHERE uuid=?'.format(','.join(['{}=?'.format(k) for k in keys])),
+                                 [kwargs[k] for k in keys]+[uuid])
+            self.con.commit()
+
+    def get(self,uuid):
+        with self.lock:
+            row = self.con.execute('SELECT {} FROM products WHERE uuid=?'.format(','.join(FIELDS)),(uuid,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(FIELDS,row))
+
+    def search(self,query_age=QUERY_AGE,**kwargs):
+        # Run one search (or reuse a recent identical one) and store the results
+        qkey = json.dumps(kwargs,sort_keys=True,default=str)
+        with self.lock:
+            row = self.con.execute('SELECT uuids,checked FROM queries WHERE qkey=?',(qkey,)).fetchone()
+        if row is not None and time.time()-row[1] < query_age:
+            return json.loads(row[0])
+        products = self.api.query(**kwargs)
+        uuids = []
+        for uuid,prop in products.items():
+            begin = prop.get('beginposition')
+            self.update(uuid,title=prop.get('title'),footprint=prop.get('footprint'),
+                        begin=None if begin is None else begin.strftime('%Y-%m-%dT%H:%M:%S'))
+            uuids.append(uuid)
+        self.execute('INSERT OR REPLACE INTO queries (qkey,uuids,checked) VALUES (?,?,?)',(qkey,json.dumps(uuids),time.time()))
+        return uuids
+
+    def refresh(self,uuids,batch_size=BATCH_SIZE):
+        # Update size, checksum, URL and online status with batched OData queries
+        url = self.api.api_url+'odata/v1/Products'
+        for i in range(0,len(uuids),batch_size):
+            batch = uuids[i:i+batch_size]
+            params = {'$format':'json','$top':len(batch),'$filter':' or '.join(["Id eq '{}'".format(uuid) for uuid in batch])}
+            r = self.api.session.get(url,params=params,timeout=self.timeout)
+            r.raise_for_status()
+            tcur = time.time()
+            for prop in r.json()['d']['results']:
+                online = prop.get('Online',True)
+                if not isinstance(online,bool):
+                    online = str(online).lower() == 'true'
+                checksum = prop.get('Checksum') or {}
+                begin = prop.get('ContentDate',{}).get('Start')
+                m = None if begin is None else re.search('Date\((-?\d+)\)',begin)
+                kwargs = {'title':prop['Name'],'size':int(prop['ContentLength']),'online':int(online),'checked':tcur,
+                          'url':prop.get('__metadata',{}).get('media_src')}
+                if checksum.get('Algorithm','').lower() == 'md5':
+                    kwargs['md5'] = checksum.get('Value')
+                if m:
+                    kwargs['begin'] = time.strftime('%Y-%m-%dT%H:%M:%S',time.gmtime(int(m.group(1))*1.0e-3))
+                self.update(prop['Id'],**kwargs)
+
+    def set_online(self,uuid,online):
+        self.update(uuid,online=int(online),checked=time.time())
+
+    # Persistent queue of LTA (offline product) requests, state = pending|requested|online|failed
+    def enqueue(self,uuid,requested=None):
+        # A product in a final state (online|failed) is queued again, pending/requested ones are left unchanged
+        state = 'pending' if requested is None else 'requested'
+        self.execute('INSERT INTO requests (uuid,state,attempts,next_time,requested) VALUES (?,?,0,0,?)'
+                     ' ON CONFLICT(uuid) DO UPDATE SET state=excluded.state,attempts=0,next_time=0,requested=excluded.requested,message=NULL'
+                     ' WHERE requests.state IN (?,?)',(uuid,state,requested,'online','failed'))
+
+    def get_requests(self,states=('pending','requested')):
+        with self.lock:
+            rows = self.con.execute('SELECT {} FROM requests WHERE state IN ({}) ORDER BY next_time'.format(','.join(REQUEST_FIELDS),
+                                    ','.join(['?']*len(states))),states).fetchall()
+        return [dict(zip(REQUEST_FIELDS,row)) for row in rows]
+
+    def update_request(self,uuid,**kwargs):
+        keys = sorted(kwargs.keys())
+        self.execute('UPDATE requests SET {} WHERE uuid=?'.format(','.join(['{}=?'.format(k) for k in keys])),
+                     [kwargs[k] for k in keys]+[uuid])
+
+def search_products(catalog,opts):
+    # Translate sentinelsat command line options into a catalog search
+    if opts.uuid is not None:
+        return [uuid.strip() for uuid in opts.uuid.split(',')]
+    from sentinelsat import read_geojson,geojson_to_wkt
+    kwargs = {}
+    kwargs['date'] = ('NOW-1DAY' if opts.start is None else opts.start,'NOW' if opts.end is None else opts.end) # sentinelsat CLI defaults
+    if opts.geometry is not None:
+        kwargs['area'] = geojson_to_wkt(read_geojson(opts.geometry))
+    if opts.name is not None:
+        names = [name.strip() for name in opts.name.split(',')]
+        kwargs['identifier'] = names[0] if len(names) == 1 else '('+' OR '.join(names)+')'
+    if opts.sentinel is not None:
+        kwargs['platformname'] = 'Sentinel-{}'.format(opts.sentinel)
+    if opts.instrument is not None:
+        kwargs['instrumentshortname'] = opts.instrument
+    if opts.producttype is not None:
+        kwargs['producttype'] = opts.producttype
+    if opts.cloud is not None:
+        kwargs['cloudcoverpercentage'] = (0,opts.cloud)
+    if opts.query is not None:
+        for item in opts.query.split(','):
+            key,value = item.split('=',1)
+            kwargs[key.strip()] = value.strip()
+    if opts.order_by is not None:
+        kwargs['order_by'] = opts.order_by
+    if opts.limit is not None:
+        kwargs['limit'] = opts.limit
+    return catalog.search(query_age=opts.query_age,**kwargs)
+
+def read_aoi(fnam):
+    # Union of the geometries in a GeoJSON file (e.g. cihea.json)
+    from shapely.geometry import shape
+    from shapely.ops import unary_union
+    with open(fnam,'r') as fp:
+        data = json.load(fp)
+    if data['type'] == 'FeatureCollection':
+        geoms = [shape(f['geometry']) for f in data['features']]
+    elif data['type'] == 'Feature':
+        geoms = [shape(data['geometry'])]
+    else:
+        geoms = [shape(data)]
+    return unary_union(geoms)
+
+def plan_products(catalog,uuids,aoi=None,min_coverage=0.0,priority=None):
+    # Drop products covering less than min_coverage of the AOI and order the rest,
+    # priority = newest|oldest (None keeps the search order). Returns (uuids,coverages).
+    from shapely import wkt
+    items = []
+    for uuid in uuids:
+        p = catalog.get(uuid)
+        coverage = None
+        if aoi is not None and p is not None and p['footprint'] is not None:
+            coverage = wkt.loads(p['footprint']).intersection(aoi).area/aoi.area
+            if coverage < min_coverage:
+                sys.stderr.write('###### Coverage {:.3f} < {:.3f}, skip >>> {}\n'.format(coverage,min_coverage,p['title']))
+                continue
+        items.append((uuid,coverage,'' if p is None or p['begin'] is None else p['begin']))
+    if priority == 'newest':
+        items.sort(key=lambda x: x[2],reverse=True)
+    elif priority == 'oldest':
+        items.sort(key=lambda x: x[2])
+    elif priority is not None:
+        raise ValueError('Error, priority={}'.format(priority))
+    return [x[0] for x in items],[x[1] for x in items]
+
+def write_footprints(catalog,uuids,fnam='search_footprints.geojson'):
+    from shapely import wkt
+    from shapely.geometry import mapping
+    features = []
+    for uuid in uuids:
+        p = catalog.get(uuid)
+        if p is None or p['footprint'] is None:
+            continue
+        features.append({'type':'Feature','geometry':mapping(wkt.loads(p['footprint'])),
+                         'properties':{k:p[k] for k in FIELDS if k != 'footprint'}})
+    with open(fnam,'w') as fp:
+        json.dump({'type':'FeatureCollection','features':features},fp)
@@ -1,19 +1,12 @@
 #!/usr/bin/env python
 import os
-import psutil
 import sys
-import re
 import time
-import select
-import _thread
-import threading
-import signal
-import atexit
-import numpy as np
-from datetime import datetime
-from glob import glob
-from subprocess import Popen,check_output,PIPE
 from sentinelsat import SentinelAPI
+from sentinel_catalog import DBNAM,QUERY_AGE,Catalog,search_products,read_aoi,plan_products,write_footprints
+from concurrent.futures import wait,FIRST_COMPLETED
+from sentinel_transfer import Downloader,SlotLock,link_file,write_progress
+from site_manifest import Manifest
 from optparse import OptionParser,IndentedHelpFormatter
 
 TIMEOUT = 60
@@ -21,6 +14,8 @@ DOWNLOAD_CHECK_TIME = 10
 ONLINE_CHECK_TIME = 300
 WAIT_TIME = 10
 MAX_RETRY = 100
+WORKERS = 4
+MIN_COVERAGE = 0.0
 
 # Read options
 parser = OptionParser(formatter=IndentedHelpFormatter(max_help_position=200,width=200))
@@ -40,259 +35,175 @@ parser.add_option('-o','--order_by',default=None,help='Comma-separated list of k
 parser.add_option('-l','--limit',default=None,type='int',help='Maximum number of results to return.  Defaults to no limit.')
 parser.add_option('-P','--path',default=None,help='Set the path where the files will be saved.')
 parser.add_option('-q','--query',default=None,help='Extra search keywords you want to use in the query. Separate keywords with comma. Example: \'producttype=GRD,polarisationmode=HH\'.')
-parser.add_option('-T','--timeout',default=TIMEOUT,type='float',help='Timeout to download data in sec (%default)')
-parser.add_option('-w','--download_check_time',default=DOWNLOAD_CHECK_TIME,type='int',help='Wait time to check downloaded data in sec (%default)')
+parser.add_option('-T','--timeout',default=TIMEOUT,type='float',help='Stall timeout of each transfer in sec (%default)')
+parser.add_option('-w','--download_check_time',default=DOWNLOAD_CHECK_TIME,type='int',help='Interval of progress report in sec (%default)')
 parser.add_option('-W','--wait_time',default=WAIT_TIME,type='int',help='Wait time to download data in sec (%default)')
-parser.add_option('-O','--online_check_time',default=ONLINE_CHECK_TIME,type='int',help='Wait time to check online data in sec (%default)')
-parser.add_option('-M','--max_retry',default=MAX_RETRY,type='int',help='Maximum number of retries to download data (%default)')
+parser.add_option('-O','--online_check_time',default=ONLINE_CHECK_TIME,type='int',help='Wait time to check offline data again in sec (%default)')
+parser.add_option('-M','--max_retry',default=MAX_RETRY,type='int',help='Maximum number of retries to download data or to check offline data (%default)')
+parser.add_option('--workers',default=WORKERS,type='int',help='Maximum number of concurrent downloads (%default)')
+parser.add_option('--slot_dir',default=None,help='Lock directory shared by download processes for a global limit of concurrent downloads (%default)')
+parser.add_option('--slots',default=None,type='int',help='Global maximum number of concurrent downloads, requires --slot_dir (%default)')
+parser.add_option('--manifest',default=None,help='Manifest file updated when downloads finish (%default)')
+parser.add_option('--store',default=None,help='Product store shared by sites, files in path are linked to the store, per-file locks are in --slot_dir or STORE/.locks (%default)')
 parser.add_option('-d','--download',default=False,action='store_true',help='Download all results of the query. (%default)')
-parser.add_option('-C','--checksum',default=False,action='store_true',help='Verify the downloaded files\' integrity by checking its MD5 checksum. (%default)')
+parser.add_option('-C','--checksum',default=True,action='store_true',help='Verify the downloaded files\' integrity by checking its MD5 checksum while downloading. (%default)')
+parser.add_option('--no_checksum',dest='checksum',action='store_false',help='Do not verify MD5 checksum.')
+parser.add_option('--min_coverage',default=MIN_COVERAGE,type='float',help='Minimum fraction of the search area covered by a product footprint (%default)')
+parser.add_option('--priority',default=None,help='[newest|oldest] Download order by acquisition date, search order if not given (%default)')
+parser.add_option('--catalog',default=DBNAM,help='Product catalog file (%default)')
+parser.add_option('--query_age',default=QUERY_AGE,type='int',help='Reuse identical search results younger than this in sec (%default)')
 parser.add_option('-f','--footprints',default=False,action='store_true',help='Create a geojson file search_footprints.geojson with footprints and metadata of the returned products. (%default)')
 parser.add_option('-v','--version',default=False,action='store_true',help='Show the version and exit. (%default)')
 parser.add_option('-Q','--quiet',default=False,action='store_true',help='Quiet mode (%default)')
 (opts,args) = parser.parse_args()
 
-process_id = None
-def kill_process():
-    if process_id is not None:
-        if not psutil.pid_exists(process_id):
-            return
-        sys.stderr.write('KILL PROCESS\n')
-        if os.name.lower() != 'posix':
-            parent = psutil.Process(process_id)
-            children = parent.children(recursive=True)
-            for child in children:
-                child.kill()
-            parent.kill()
-        else:
-            os.killpg(os.getpgid(process_id),signal.SIGTERM)
-atexit.register(kill_process)
-
-command = 'sentinelsat'
-if opts.user is not None:
-    command += ' --user {}'.format(opts.user)
-if opts.password is not None:
-    command += ' --password {}'.format(opts.password)
-if opts.url is not None:
-    command += ' --url {}'.format(opts.url)
-if opts.start is not None:
-    command += ' --start {}'.format(opts.start)
-if opts.end is not None:
-    command += ' --end {}'.format(opts.end)
-if opts.geometry is not None:
-    command += ' --geometry {}'.format(opts.geometry)
-if opts.uuid is not None:
-    command += ' --uuid {}'.format(opts.uuid)
-if opts.name is not None:
-    command += ' --name {}'.format(opts.name)
-if opts.sentinel is not None:
-    command += ' --sentinel {}'.format(opts.sentinel)
-if opts.instrument is not None:
-    command += ' --instrument {}'.format(opts.instrument)
-if opts.producttype is not None:
-    command += ' --producttype {}'.format(opts.producttype)
-if opts.cloud is not None:
-    command += ' --cloud {}'.format(opts.cloud)
-if opts.order_by is not None:
-    command += ' --order_by {}'.format(opts.order_by)
-if opts.limit is not None:
-    command += ' --limit {}'.format(opts.limit)
-if opts.path is not None:
-    command += ' --path {}'.format(opts.path)
-if opts.query is not None:
-    command += ' --query {}'.format(opts.query)
-#if opts.download:
-#    command += ' --download'
-if not opts.checksum:
-    command += ' --no-checksum'
-if opts.footprints:
-    command += ' --footprints'
-if opts.version:
-    command += ' --version'
-sys.stderr.write(command+'\n')
-out = check_output(command+' 2>&1',shell=True).decode()
-sys.stderr.write(out+'\n')
 if opts.version:
+    import sentinelsat
+    sys.stderr.write('sentinelsat {}\n'.format(sentinelsat.__version__))
     sys.exit()
+if opts.user is None:
+    opts.user = os.environ.get('DHUS_USER')
+if opts.password is None:
+    opts.password = os.environ.get('DHUS_PASSWORD')
+if opts.url is None:
+    opts.url = os.environ.get('DHUS_URL')
 
-uuids = []
-for line in out.splitlines():
-    # Product bb7a7783-f91b-4a35-907d-a6ddb807da73 - Date: 2019-07-09T02:55:59.024Z, Instrument: MSI, Mode: , Satellite: Sentinel-2, Size: 1.09 GB
-    m = re.search('Product\s+(\S+)',line)
-    if not m:
-        continue
-    uuids.append(m.group(1))
-
-names = []
-sizes = []
-stats = []
 if opts.url is not None:
     api = SentinelAPI(opts.user,opts.password,opts.url)
 else:
     api = SentinelAPI(opts.user,opts.password)
-for i,uuid in enumerate(uuids):
-    out = api.get_product_odata(uuid)
-    name = out['title']
-    size = out['size']
-    stat = out['Online']
-    names.append(name)
-    sizes.append(size)
-    stats.append(stat)
-    sys.stderr.write('{:4d} {:40s} {:70s} {:10d} {:7s}\n'.format(i+1,uuid,name,size,'Online' if stat else 'Offline'))
-api.session.close() # has any effect?
+catalog = Catalog(opts.catalog,api)
+uuids = search_products(catalog,opts)
+catalog.refresh(uuids) # one batched query for sizes, checksums and online status
+if opts.footprints:
+    write_footprints(catalog,uuids)
+aoi = None if opts.geometry is None else read_aoi(opts.geometry)
+uuids,coverages = plan_products(catalog,uuids,aoi,opts.min_coverage,opts.priority)
+
+names = []
+sizes = []
+stats = []
+urls = []
+md5s = []
+for uuid,coverage in zip(list(uuids),coverages):
+    p = catalog.get(uuid)
+    if p is None or p['size'] is None:
+        sys.stderr.write('Warning, no such product >>> {}\n'.format(uuid))
+        uuids.remove(uuid)
+        continue
+    names.append(p['title'])
+    sizes.append(p['size'])
+    stats.append(bool(p['online']))
+    urls.append(p['url'])
+    md5s.append(p['md5'])
+    sys.stderr.write('{:4d} {:40s} {:70s} {:10d} {:7s} {:>6s}\n'.format(len(names),uuid,names[-1],sizes[-1],'Online' if stats[-1] else 'Offline',
+                                                                  '-' if coverage is None else '{:6.3f}'.format(coverage)))
+path = '.' if opts.path is None else opts.path
+nbyte = 0
+nprod = 0
+for i in range(len(uuids)):
+    fnam = os.path.join(path,names[i]+'.zip')
+    if os.path.exists(fnam) and os.path.getsize(fnam) == sizes[i]:
+        continue
+    nbyte += sizes[i]
+    nprod += 1
+sys.stderr.write('###### Expected download: {} products, {:.3f} GB\n'.format(nprod,nbyte*1.0e-9))
 
 if opts.download:
-    path = '.' if opts.path is None else opts.path
+    manifest = None if opts.manifest is None else Manifest(opts.manifest)
+    targets = {} # file in the store: file in path
+    def store_fnam(i):
+        # Products in the store are keyed by product identifier and checksum
+        if md5s[i] is None:
+            return os.path.join(opts.store,names[i]+'.zip')
+        return os.path.join(opts.store,'{}_{}.zip'.format(names[i],md5s[i].lower()))
+    def finish(fnam,fsiz):
+        if fnam in targets:
+            link_file(fnam,targets[fnam])
+            fnam = targets[fnam]
+        if manifest is not None:
+            manifest.update(fnam,size=fsiz)
+    def callback(event,fnam,done,total,message):
+        if event == 'done':
+            finish(fnam,done)
+        if opts.quiet and event == 'progress':
+            return
+        write_progress(event,fnam,done,total,message)
+    def submit(i):
+        fnam = os.path.join(path,names[i]+'.zip')
+        if opts.store is not None:
+            snam = store_fnam(i)
+            targets[snam] = fnam
+            fnam = snam
+        return downloader.submit(urls[i],fnam,sizes[i],md5s[i] if opts.checksum else None)
+    if opts.slot_dir is not None and opts.slots is not None:
+        slot_lock = SlotLock(opts.slot_dir,opts.slots)
+    else:
+        slot_lock = None
+    if opts.store is not None and not os.path.isdir(opts.store):
+        os.makedirs(opts.store)
+    if opts.store is None:
+        lock_dir = None
+    elif opts.slot_dir is not None:
+        lock_dir = opts.slot_dir
+    else:
+        lock_dir = os.path.join(opts.store,'.locks')
+    downloader = Downloader(session=api.session,workers=opts.workers,timeout=opts.timeout,interval=opts.download_check_time,
+                            wait_time=opts.wait_time,max_retry=opts.max_retry,callback=callback,slot_lock=slot_lock,
+                            lock_dir=lock_dir)
+    parked = {} # offline products, index: [next check time, number of checks]
+    running = {} # future: index
     for i in range(len(uuids)):
         # Check data availability
         fnam = os.path.join(path,names[i]+'.zip')
-        gnam = os.path.join(fnam+'.incomplete')
-        # Skip if gnam does not exist and fnam with expected size exists
-        if os.path.exists(fnam) and not os.path.exists(gnam):
+        # Skip if fnam with expected size exists
+        if os.path.exists(fnam):
             fsiz = os.path.getsize(fnam)
             if fsiz == sizes[i]:
                 sys.stderr.write('###### Successfully downloaded >>> {}\n'.format(fnam))
+                if manifest is not None:
+                    manifest.update(fnam,size=fsiz)
+                continue
+        # Skip if the product is already in the store
+        if opts.store is not None:
+            snam = store_fnam(i)
+            if os.path.exists(snam) and os.path.getsize(snam) == sizes[i]:
+                sys.stderr.write('###### Found in the store >>> {}\n'.format(snam))
+                targets[snam] = fnam
+                finish(snam,sizes[i])
                 continue
-        gnam = os.path.join(fnam+'.request')
-        if opts.url is not None:
-            api = SentinelAPI(opts.user,opts.password,opts.url)
+        if stats[i]: # Online
+            running[submit(i)] = i
+        else:
+            sys.stderr.write('Offline. Check again after {} sec >>> {}\n'.format(opts.online_check_time,fnam))
+            parked[i] = [time.time()+opts.online_check_time,0]
+    # Download whatever is online while offline products are parked
+    while len(running) > 0 or len(parked) > 0:
+        if len(parked) > 0:
+            timeout = max(min([v[0] for v in parked.values()])-time.time(),0.0)
         else:
-            api = SentinelAPI(opts.user,opts.password)
-        while True:
-            out = api.get_product_odata(uuids[i])
-            stat = out['Online']
-            if stat: # Online
-                if os.path.exists(gnam):
-                    os.remove(gnam)
-                break
-            sys.stderr.write('Offline. Wait for {} sec >>> {}\n'.format(opts.online_check_time,fnam))
-            time.sleep(opts.online_check_time)
+            timeout = None
+        if len(running) > 0:
+            done,not_done = wait(list(running.keys()),timeout=timeout,return_when=FIRST_COMPLETED)
+            for future in done:
+                running.pop(future)
+        else:
+            time.sleep(timeout)
+        tcur = time.time()
+        indxs = [i for i in parked if parked[i][0] <= tcur]
+        if len(indxs) < 1:
             continue
-        api.session.close() # has any effect?
-        # Download data
-        gnam = os.path.join(fnam+'.incomplete')
-        command = 'sentinelsat'
-        command += ' --download'
-        command += ' --uuid {}'.format(uuids[i])
-        if opts.user is not None:
-            command += ' --user {}'.format(opts.user)
-        if opts.password is not None:
-            command += ' --password {}'.format(opts.password)
-        if opts.url is not None:
-            command += ' --url {}'.format(opts.url)
-        if opts.path is not None:
-            command += ' --path {}'.format(opts.path)
-        if not opts.checksum:
-            command += ' --no-checksum'
-        for ntry in range(opts.max_retry): # loop to download 1 file
-            # Exit if gnam does not exist and fnam with expected size exists
-            if os.path.exists(fnam):
-                fsiz = os.path.getsize(fnam)
-                if os.path.exists(gnam):
-                    gsiz = os.path.getsize(gnam)
-                    if gsiz > fsiz:
-                        os.remove(fnam)
-                    else:
-                        os.remove(gnam)
-                        os.rename(fnam,gnam)
-                else:
-                    if fsiz == sizes[i]:
-                        sys.stderr.write('###### Successfully downloaded >>> {}\n'.format(fnam))
-                        break
-                    else:
-                        os.rename(fnam,gnam)
-            # Start a process
-            p = None
-            process_id = None
-            start_time = time.time()
-            try:
-                if opts.quiet:
-                    if os.name.lower() != 'posix':
-                        p = Popen(command,stdout=PIPE,stderr=PIPE,bufsize=0,universal_newlines=True,encoding='utf-8',shell=True)
-                    else:
-                        p = Popen(command,stdout=PIPE,stderr=PIPE,bufsize=0,universal_newlines=True,encoding='utf-8',shell=True,preexec_fn=os.setsid)
-                else:
-                    if os.name.lower() != 'posix':
-                        p = Popen(command,universal_newlines=True,encoding='utf-8',shell=True)
-                    else:
-                        p = Popen(command,universal_newlines=True,encoding='utf-8',shell=True,preexec_fn=os.setsid)
-                process_id = p.pid
-            except Exception:
-                sys.stderr.write('Failed to run the command. Wait for {} sec\n'.format(opts.wait_time))
-                time.sleep(opts.wait_time)
-                continue
-            while True: # loop to terminate the process
-                if opts.quiet:
-                    while True:
-                        try:
-                            timer = threading.Timer(opts.timeout,_thread.interrupt_main)
-                            timer.start()
-                            while p.stderr in select.select([p.stderr],[],[],opts.download_check_time)[0]:
-                                line = p.stderr.readline()
-                                if line:
-                                    line_lower = line.lower()
-                                    if re.search('raise ',line_lower):
-                                        continue
-                                    elif re.search('sentinelapiltaerror',line_lower):
-                                        continue
-                                    elif re.search('will ',line_lower):
-                                        sys.stderr.write(line)
-                                    elif re.search('triggering ',line_lower):
-                                        sys.stderr.write(line)
-                                    elif re.search('requests ',line_lower):
-                                        sys.stderr.write(line)
-                                    elif re.search('accept',line_lower):
-                                        sys.stderr.write(line)
-                                    elif re.search('quota',line_lower):
-                                        sys.stderr.write(line)
-                                    elif re.search('downloading ',line_lower):
-                                        sys.stderr.write(line)
-                                    elif re.search('downloading:',line_lower):
-                                        sys.stderr.write(line.rstrip()+'\033[0K\r')
-                                    sys.stderr.flush()
-                                    timer.cancel()
-                                    timer = threading.Timer(opts.timeout,_thread.interrupt_main)
-                                    timer.start()
-                                else:
-                                    break
-                            timer.cancel()
-                        except KeyboardInterrupt:
-                            pass
-                        break
-                # Exit if fnam exists or gnam exists and its size does not change for opts.timeout seconds
-                if p.poll() is not None: # the process has terminated
-                    break
-                elif os.path.exists(fnam):
-                    break
-                elif os.path.exists(gnam):
-                    diff = time.time()-max(start_time,os.path.getmtime(gnam))
-                    if diff > opts.timeout:
-                        break
-                time.sleep(opts.download_check_time)
-            if p.poll() is None: # the process hasn't terminated yet.
-                sys.stderr.write('\nTimeout\n')
-            kill_process()
-            if opts.quiet:
-                out,err = p.communicate()
-                sys.stderr.write('\n')
-                for line in err.splitlines():
-                    line_lower = line.lower()
-                    if re.search('raise ',line_lower):
-                        continue
-                    elif re.search('sentinelapiltaerror',line_lower):
-                        continue
-                    elif re.search('will ',line_lower):
-                        sys.stderr.write(line+'\n')
-                    elif re.search('triggering ',line_lower):
-                        sys.stderr.write(line+'\n')
-                    elif re.search('requests ',line_lower):
-                        sys.stderr.write(line+'\n')
-                    elif re.search('accept',line_lower):
-                        sys.stderr.write(line+'\n')
-                    elif re.search('quota',line_lower):
-                        sys.stderr.write(line+'\n')
-                    elif re.search('downloading ',line_lower):
-                        sys.stderr.write(line+'\n')
-            process_id = None
-            sys.stderr.write('Wait for {} sec\n'.format(opts.wait_time))
-            time.sleep(opts.wait_time)
+        catalog.refresh([uuids[i] for i in indxs]) # one batched query for all due products
+        for i in indxs:
+            fnam = os.path.join(path,names[i]+'.zip')
+            if catalog.get(uuids[i])['online']:
+                parked.pop(i)
+                running[submit(i)] = i
+            elif parked[i][1]+1 >= opts.max_retry:
+                parked.pop(i)
+                sys.stderr.write('###### Still offline, give up >>> {}\n'.format(fnam))
+            else:
+                parked[i] = [tcur+opts.online_check_time,parked[i][1]+1]
+                sys.stderr.write('Offline. Check again after {} sec >>> {}\n'.format(opts.online_check_time,fnam))
+    downloader.close()
+api.session.close() # has any effect?
@@ -1,23 +1,18 @@
 #!/usr/bin/env python
 import os
-import psutil
 import sys
-import re
 import time
-import signal
-import atexit
-import numpy as np
-from datetime import datetime
-from glob import glob
-from subprocess import Popen,check_output,PIPE,TimeoutExpired
+from concurrent.futures import ThreadPoolExecutor
 from sentinelsat import SentinelAPI
+from sentinel_catalog import DBNAM,QUERY_AGE,Catalog,search_products,write_footprints
 from optparse import OptionParser,IndentedHelpFormatter
 
 TIMEOUT = 60
-CHECK_TIME = 10
-WAIT_TIME = 1800
+WAIT_TIME = 300
 RETRY_TIME = 86400
 MAX_RETRY = 100
+QUOTA = 20
+BACKOFF = 600
 
 # Read options
 parser = OptionParser(formatter=IndentedHelpFormatter(max_help_position=200,width=200))
@@ -38,211 +33,126 @@ parser.add_option('-l','--limit',default=None,type='int',help='Maximum number of
 parser.add_option('-P','--path',default=None,help='Set the path where the files will be saved.')
 parser.add_option('-q','--query',default=None,help='Extra search keywords you want to use in the query. Separate keywords with comma. Example: \'producttype=GRD,polarisationmode=HH\'.')
 parser.add_option('-T','--timeout',default=TIMEOUT,type='float',help='Timeout to request data in sec (%default)')
-parser.add_option('-w','--check_time',default=CHECK_TIME,type='int',help='Wait time to check data in sec (%default)')
-parser.add_option('-W','--wait_time',default=WAIT_TIME,type='int',help='Wait time to request next data in sec (%default)')
+parser.add_option('-W','--wait_time',default=WAIT_TIME,type='int',help='Wait time to poll the status of requested data in sec (%default)')
 parser.add_option('-R','--retry_time',default=RETRY_TIME,type='int',help='Wait time to request the same data again in sec (%default)')
-parser.add_option('-M','--max_retry',default=MAX_RETRY,type='int',help='Maximum number of retries to download data (%default)')
-parser.add_option('-C','--checksum',default=False,action='store_true',help='Verify the downloaded files\' integrity by checking its MD5 checksum. (%default)')
+parser.add_option('-M','--max_retry',default=MAX_RETRY,type='int',help='Maximum number of retries to request data (%default)')
+parser.add_option('--quota',default=QUOTA,type='int',help='Maximum number of outstanding requests allowed for the account (%default)')
+parser.add_option('--backoff',default=BACKOFF,type='int',help='Initial wait time after a rejected request in sec, doubled for every rejection (%default)')
+parser.add_option('--once',default=False,action='store_true',help='Process the queue only once and exit (%default)')
+parser.add_option('--catalog',default=DBNAM,help='Product catalog file (%default)')
+parser.add_option('--query_age',default=QUERY_AGE,type='int',help='Reuse identical search results younger than this in sec (%default)')
 parser.add_option('-f','--footprints',default=False,action='store_true',help='Create a geojson file search_footprints.geojson with footprints and metadata of the returned products. (%default)')
 parser.add_option('-v','--version',default=False,action='store_true',help='Show the version and exit. (%default)')
 parser.add_option('-V','--verbose',default=False,action='store_true',help='Verbose mode (%default)')
 (opts,args) = parser.parse_args()
 
-process_id = None
-def kill_process():
-    if process_id is not None:
-        if not psutil.pid_exists(process_id):
-            return
-        sys.stderr.write('KILL PROCESS\n')
-        if os.name.lower() != 'posix':
-            parent = psutil.Process(process_id)
-            children = parent.children(recursive=True)
-            for child in children:
-                child.kill()
-            parent.kill()
-        else:
-            os.killpg(os.getpgid(process_id),signal.SIGTERM)
-atexit.register(kill_process)
-
-command = 'sentinelsat'
-if opts.user is not None:
-    command += ' --user {}'.format(opts.user)
-if opts.password is not None:
-    command += ' --password {}'.format(opts.password)
-if opts.url is not None:
-    command += ' --url {}'.format(opts.url)
-if opts.start is not None:
-    command += ' --start {}'.format(opts.start)
-if opts.end is not None:
-    command += ' --end {}'.format(opts.end)
-if opts.geometry is not None:
-    command += ' --geometry {}'.format(opts.geometry)
-if opts.uuid is not None:
-    command += ' --uuid {}'.format(opts.uuid)
-if opts.name is not None:
-    command += ' --name {}'.format(opts.name)
-if opts.sentinel is not None:
-    command += ' --sentinel {}'.format(opts.sentinel)
-if opts.instrument is not None:
-    command += ' --instrument {}'.format(opts.instrument)
-if opts.producttype is not None:
-    command += ' --producttype {}'.format(opts.producttype)
-if opts.cloud is not None:
-    command += ' --cloud {}'.format(opts.cloud)
-if opts.order_by is not None:
-    command += ' --order_by {}'.format(opts.order_by)
-if opts.limit is not None:
-    command += ' --limit {}'.format(opts.limit)
-if opts.path is not None:
-    command += ' --path {}'.format(opts.path)
-if opts.query is not None:
-    command += ' --query {}'.format(opts.query)
-if not opts.checksum:
-    command += ' --no-checksum'
-if opts.footprints:
-    command += ' --footprints'
-if opts.version:
-    command += ' --version'
-sys.stderr.write(command+'\n')
-out = check_output(command+' 2>&1',shell=True).decode()
-sys.stderr.write(out+'\n')
 if opts.version:
+    import sentinelsat
+    sys.stderr.write('sentinelsat {}\n'.format(sentinelsat.__version__))
     sys.exit()
+if opts.user is None:
+    opts.user = os.environ.get('DHUS_USER')
+if opts.password is None:
+    opts.password = os.environ.get('DHUS_PASSWORD')
+if opts.url is None:
+    opts.url = os.environ.get('DHUS_URL')
 
-uuids = []
-for line in out.splitlines():
-    # Product bb7a7783-f91b-4a35-907d-a6ddb807da73 - Date: 2019-07-09T02:55:59.024Z, Instrument: MSI, Mode: , Satellite: Sentinel-2, Size: 1.09 GB
-    m = re.search('Product\s+(\S+)',line)
-    if not m:
-        continue
-    uuids.append(m.group(1))
-
-names = []
-sizes = []
-stats = []
 if opts.url is not None:
     api = SentinelAPI(opts.user,opts.password,opts.url)
 else:
     api = SentinelAPI(opts.user,opts.password)
-for i,uuid in enumerate(uuids):
-    out = api.get_product_odata(uuid)
-    name = out['title']
-    size = out['size']
-    stat = out['Online']
-    names.append(name)
-    sizes.append(size)
-    stats.append(stat)
-    sys.stderr.write('{:4d} {:40s} {:70s} {:10d} {:7s}\n'.format(i+1,uuid,name,size,'Online' if stat else 'Offline'))
-api.session.close() # has any effect?
+catalog = Catalog(opts.catalog,api)
+uuids = search_products(catalog,opts)
+catalog.refresh(uuids) # one batched query for sizes, checksums and online status
+if opts.footprints:
+    write_footprints(catalog,uuids)
 
+names = []
+sizes = []
+stats = []
+for uuid in list(uuids):
+    p = catalog.get(uuid)
+    if p is None or p['size'] is None:
+        sys.stderr.write('Warning, no such product >>> {}\n'.format(uuid))
+        uuids.remove(uuid)
+        continue
+    names.append(p['title'])
+    sizes.append(p['size'])
+    stats.append(bool(p['online']))
+    sys.stderr.write('{:4d} {:40s} {:70s} {:10d} {:7s}\n'.format(len(names),uuid,names[-1],sizes[-1],'Online' if stats[-1] else 'Offline'))
+
+def trigger(uuid):
+    # Trigger retrieval from the Long Term Archive, returns (HTTP status, message)
+    p = catalog.get(uuid)
+    try:
+        with api.session.get(p['url'],stream=True,timeout=opts.timeout) as r: # the body is not read
+            return r.status_code,r.reason
+    except Exception as e:
+        return None,'{}'.format(e)
+
+# Add offline products to the persistent queue
 path = '.' if opts.path is None else opts.path
 for i in range(len(uuids)):
-    fnam = os.path.join(path,names[i]+'.zip')
-    gnam = os.path.join(fnam+'.request')
-    if stats[i]: # Online
-        sys.stderr.write('###### Already online >>> {}\n'.format(fnam))
-        if os.path.exists(gnam):
-            os.remove(gnam)
+    if stats[i]:
         continue
+    gnam = os.path.join(path,names[i]+'.zip.request') # marker files of the previous version
     if os.path.exists(gnam):
-        diff = time.time()-os.path.getmtime(gnam)
-        if diff < opts.retry_time:
-            sys.stderr.write('###### Already requested >>> {}\n'.format(fnam))
-            continue
-        else:
-            os.remove(gnam)
-    command = 'sentinelsat'
-    command += ' --download'
-    command += ' --uuid {}'.format(uuids[i])
-    if opts.user is not None:
-        command += ' --user {}'.format(opts.user)
-    if opts.password is not None:
-        command += ' --password {}'.format(opts.password)
-    if opts.url is not None:
-        command += ' --url {}'.format(opts.url)
-    if opts.path is not None:
-        command += ' --path {}'.format(opts.path)
-    if not opts.checksum:
-        command += ' --no-checksum'
-    for ntry in range(opts.max_retry): # loop to request 1 file
-        # Start a process
-        p = None
-        process_id = None
-        start_time = time.time()
-        if opts.verbose:
-            try:
-                if os.name.lower() != 'posix':
-                    p = Popen(command,shell=True)
-                else:
-                    p = Popen(command,shell=True,preexec_fn=os.setsid)
-                process_id = p.pid
-            except Exception:
-                sys.stderr.write('Error in request >>> {}\n'.format(fnam))
-                continue
-            while True: # loop to terminate the process
-                if p.poll() is not None: # the process has terminated
-                    break
-                diff = time.time()-start_time
-                if diff > opts.timeout:
-                    break
-                time.sleep(opts.check_time)
-            result = p.poll()
-            sys.stderr.write('\n')
-            if result is None: # the process hasn't terminated yet.
-                sys.stderr.write('Timeout\n')
-            elif result != 0:
-                sys.stderr.write('###### Not requested >>> {}\n'.format(fnam))
-            else:
-                with open(gnam,'w') as fp:
-                    fp.write('{}'.format(time.time()))
-                sys.stderr.write('###### Successfully requested >>> {}\n'.format(fnam))
-                break
-            kill_process()
-        else:
-            try:
-                if os.name.lower() != 'posix':
-                    p = Popen(command,stdout=PIPE,stderr=PIPE,shell=True)
+        catalog.enqueue(uuids[i],requested=os.path.getmtime(gnam))
+        os.remove(gnam)
+    else:
+        catalog.enqueue(uuids[i])
+
+while True:
+    queue = catalog.get_requests()
+    if len(queue) < 1:
+        sys.stderr.write('###### No product to be requested\n')
+        break
+    # Poll completion in bulk
+    catalog.refresh([q['uuid'] for q in queue])
+    tcur = time.time()
+    pending = []
+    nrequested = 0
+    for q in queue:
+        p = catalog.get(q['uuid'])
+        if p['online']:
+            catalog.update_request(q['uuid'],state='online')
+            sys.stderr.write('###### Online >>> {}\n'.format(p['title']))
+        elif q['state'] == 'requested':
+            if tcur-q['requested'] < opts.retry_time:
+                nrequested += 1
+            else: # request again
+                catalog.update_request(q['uuid'],state='pending',next_time=tcur)
+                pending.append(q)
+        elif q['next_time'] <= tcur:
+            pending.append(q)
+    # Trigger up to the quota in parallel
+    nslot = max(opts.quota-nrequested,0)
+    triggers = pending[:nslot]
+    sys.stderr.write('Requested: {}, Pending: {}, Trigger: {}\n'.format(nrequested,len(pending),len(triggers)))
+    if len(triggers) > 0:
+        with ThreadPoolExecutor(max_workers=len(triggers)) as executor:
+            results = list(executor.map(trigger,[q['uuid'] for q in triggers]))
+        tcur = time.time()
+        for q,(status,message) in zip(triggers,results):
+            title = catalog.get(q['uuid'])['title']
+            if opts.verbose:
+                sys.stderr.write('{} {} >>> {}\n'.format(status,message,title))
+            if status == 202: # Accepted
+                catalog.update_request(q['uuid'],state='requested',requested=tcur,message=message)
+                sys.stderr.write('###### Successfully requested >>> {}\n'.format(title))
+            elif status == 200:
+                catalog.update_request(q['uuid'],state='online',message=message)
+                sys.stderr.write('###### Already online >>> {}\n'.format(title))
+            else: # quota exceeded (403/429/503) or other errors
+                attempts = q['attempts']+1
+                if attempts >= opts.max_retry:
+                    catalog.update_request(q['uuid'],state='failed',attempts=attempts,message=message)
+                    sys.stderr.write('###### Failed to request ({}) >>> {}\n'.format(message,title))
                 else:
-                    p = Popen(command,stdout=PIPE,stderr=PIPE,shell=True,preexec_fn=os.setsid)
-                process_id = p.pid
-            except Exception:
-                sys.stderr.write('Error in request >>> {}\n'.format(fnam))
-                continue
-            try:
-                out,err = p.communicate(timeout=opts.timeout)
-                result = p.poll()
-            except TimeoutExpired:
-                kill_process()
-                out,err = p.communicate()
-                result = None
-            sys.stderr.write('\n')
-            for line in err.decode().splitlines():
-                line_lower = line.lower()
-                if re.search('raise ',line_lower):
-                    continue
-                elif re.search('sentinelapiltaerror',line_lower):
-                    continue
-                elif re.search('will ',line_lower):
-                    sys.stderr.write(line+'\n')
-                elif re.search('download ',line_lower):
-                    sys.stderr.write(line+'\n')
-                elif re.search('triggering ',line_lower):
-                    sys.stderr.write(line+'\n')
-                elif re.search('requests ',line_lower):
-                    sys.stderr.write(line+'\n')
-                elif re.search('accept',line_lower):
-                    sys.stderr.write(line+'\n')
-                elif re.search('quota',line_lower):
-                    sys.stderr.write(line+'\n')
-            if result is None:
-                sys.stderr.write('Timeout\n')
-            elif result != 0:
-                sys.stderr.write('###### Not requested >>> {}\n'.format(fnam))
-            else:
-                with open(gnam,'w') as fp:
-                    fp.write('{}'.format(time.time()))
-                sys.stderr.write('###### Successfully requested >>> {}\n'.format(fnam))
-                break
-        process_id = None
-        sys.stderr.write('Wait for {} sec\n'.format(opts.wait_time))
-        time.sleep(opts.wait_time)
+                    backoff = min(opts.backoff*2**(attempts-1),opts.retry_time)
+                    catalog.update_request(q['uuid'],attempts=attempts,next_time=tcur+backoff,message=message)
+                    sys.stderr.write('###### Not requested ({} {}), retry in {} sec >>> {}\n'.format(status,message,backoff,title))
+    if opts.once:
+        break
+    sys.stderr.write('Wait for {} sec\n'.format(opts.wait_time))
+    time.sleep(opts.wait_time)
@@ -2,14 +2,22 @@
 import os
 import sys
 import re
+import hashlib
 import numpy as np
 import tifffile
 import xml.etree.ElementTree as ET
 import gdal
 import osr
-from scipy.interpolate import griddata
+from scipy.spatial import cKDTree
+from concurrent.futures import ProcessPoolExecutor
+from gtiff_writer import GTiffWriter
 from optparse import OptionParser,IndentedHelpFormatter
 
+# Constants
+HOME = os.environ.get('HOME')
+if HOME is None:
+    HOME = os.environ.get('HOMEPATH')
+
 # Defaults
 XMIN = 743805.0 # Cihea, pixel center
 XMAX = 757305.0 # Cihea, pixel center
@@ -18,6 +26,8 @@ YMAX = 9251805.0 # Cihea, pixel center
 XSTP = 10.0
 YSTP = -10.0
 BAND_COL = 1
+WORKERS = 1
+CACHE_DIR = os.path.join(HOME,'.cache','sentinel_resample')
 
 # Read options
 parser = OptionParser(formatter=IndentedHelpFormatter(max_help_position=200,width=200))
@@ -34,6 +44,8 @@ parser.add_option('-y','--ymin',default=YMIN,type='float',help='Minimum Y in m (
 parser.add_option('-Y','--ymax',default=YMAX,type='float',help='Maximum Y in m (%default)')
 parser.add_option('--ystp',default=YSTP,type='float',help='Step Y in m (%default)')
 parser.add_option('--band_col',default=BAND_COL,help='Band column number (%default)')
+parser.add_option('-n','--workers',default=WORKERS,type='int',help='Number of files processed concurrently (%default)')
+parser.add_option('--cache_dir',default=CACHE_DIR,help='Cache directory of index maps (%default)')
 parser.add_option('--no_check_grid',default=False,action='store_true',help='Do not check grid (%default)')
 parser.add_option('--overwrite',default=False,action='store_true',help='Overwrite mode (%default)')
 parser.add_option('--read_comments',default=False,action='store_true',help='Read comments from input_file (%default)')
@@ -47,12 +59,38 @@ xg,yg = np.meshgrid(np.arange(opts.xmin,opts.xmax+0.1*opts.xstp,opts.xstp),np.ar
 ngrd = xg.size
 ny,nx = xg.shape
 
-for input_fnam in fnams:
+def get_index_map(trans,shape):
+    # Index map from the target grid to the nearest source pixel, cached by geotransform and shape
+    key = hashlib.md5('{} {} {} {} {} {} {} {}'.format(tuple(trans),tuple(shape),opts.xmin,opts.xmax,opts.xstp,opts.ymin,opts.ymax,opts.ystp).encode()).hexdigest()
+    fnam = os.path.join(opts.cache_dir,'index_{}.npy'.format(key))
+    if os.path.exists(fnam):
+        return np.load(fnam)
+    sys.stderr.write('############ Create index map >>> {}\n'.format(fnam))
+    ny_src,nx_src = shape
+    if trans[2] == 0.0 and trans[4] == 0.0: # north-up grid
+        ix = np.clip(np.floor((xg[0,:]-trans[0])/trans[1]).astype(np.int64),0,nx_src-1)
+        iy = np.clip(np.floor((yg[:,0]-trans[3])/trans[5]).astype(np.int64),0,ny_src-1)
+        index_map = (iy[:,np.newaxis]*nx_src+ix[np.newaxis,:]).flatten()
+    else:
+        indy,indx = np.indices(shape)
+        xp = trans[0]+(indx+0.5)*trans[1]+(indy+0.5)*trans[2]
+        yp = trans[3]+(indx+0.5)*trans[4]+(indy+0.5)*trans[5]
+        tree = cKDTree(np.hstack((xp.flatten()[:,np.newaxis],yp.flatten()[:,np.newaxis])))
+        index_map = tree.query(np.hstack((xg.flatten()[:,np.newaxis],yg.flatten()[:,np.newaxis])))[1]
+    if not os.path.isdir(opts.cache_dir):
+        os.makedirs(opts.cache_dir)
+    tmp_fnam = fnam+'.{}'.format(os.getpid())
+    with open(tmp_fnam,'wb') as fp:
+        np.save(fp,index_map)
+    os.replace(tmp_fnam,fnam)
+    return index_map
+
+def resample(input_fnam):
     f,e = os.path.splitext(os.path.basename(input_fnam))
     output_fnam = f+'_resample'+e
     if os.path.exists(output_fnam) and not opts.overwrite:
         sys.stderr.write('input: '+input_fnam+', output: '+output_fnam+' ... exists, skip!\n')
-        continue
+        return
     else:
         sys.stderr.write('input: '+input_fnam+', output: '+output_fnam+'\n')
     ds = gdal.Open(input_fnam)
@@ -65,21 +103,26 @@ for input_fnam in fnams:
         output_epsg = int(epsg)
     else:
         output_epsg = opts.output_epsg
-    if ds.RasterCount < 2:
-        data = ds.ReadAsArray()[np.newaxis,...]
+    srs_out = osr.SpatialReference()
+    srs_out.ImportFromEPSG(output_epsg)
+    if not srs.IsSame(srs_out):
+        sys.stderr.write('############ Warp to EPSG:{}\n'.format(output_epsg))
+        ds_src = gdal.Warp('',ds,format='VRT',dstSRS=srs_out.ExportToWkt(),resampleAlg='near', # warped band by band on read
+                           outputBounds=(opts.xmin-0.5*opts.xstp,opts.ymin+0.5*opts.ystp,opts.xmax+0.5*opts.xstp,opts.ymax-0.5*opts.ystp),
+                           xRes=abs(opts.xstp),yRes=abs(opts.ystp))
     else:
-        data = ds.ReadAsArray()
-    trans = ds.GetGeoTransform() # maybe obtained from tif_tags['ModelTransformationTag']
-    indy,indx = np.indices(data[0].shape)
-    xp = trans[0]+(indx+0.5)*trans[1]+(indy+0.5)*trans[2]
-    yp = trans[3]+(indx+0.5)*trans[4]+(indy+0.5)*trans[5]
-    ndat = len(data)
+        ds_src = ds
+    ndat = ds_src.RasterCount
+    shape = (ds_src.RasterYSize,ds_src.RasterXSize)
+    trans = ds_src.GetGeoTransform() # maybe obtained from tif_tags['ModelTransformationTag']
     if not opts.no_check_grid:
-        indx1 = np.argmin(np.abs(xp[0,:]-xg[0,0]))
-        indx2 = np.argmin(np.abs(xp[0,:]-xg[0,-1]))+1
-        indy1 = np.argmin(np.abs(yp[:,0]-yg[0,0]))
-        indy2 = np.argmin(np.abs(yp[:,0]-yg[-1,0]))+1
-        if np.all(xg[0,:] == xp[0,indx1:indx2]) and np.all(yg[:,0] == yp[indy1:indy2,0]):
+        xp = trans[0]+(np.arange(shape[1])+0.5)*trans[1]+0.5*trans[2]
+        yp = trans[3]+0.5*trans[4]+(np.arange(shape[0])+0.5)*trans[5]
+        indx1 = np.argmin(np.abs(xp-xg[0,0]))
+        indx2 = np.argmin(np.abs(xp-xg[0,-1]))+1
+        indy1 = np.argmin(np.abs(yp-yg[0,0]))
+        indy2 = np.argmin(np.abs(yp-yg[-1,0]))+1
+        if np.all(xg[0,:] == xp[indx1:indx2]) and np.all(yg[:,0] == yp[indy1:indy2]):
             flag_grid = True
         else:
             flag_grid = False
@@ -130,7 +173,6 @@ for input_fnam in fnams:
                     m = re.search('([^=]+)=([^=]+)',value.text)
                     if m:
                         comments.update({m.group(1).strip():m.group(2).strip()})
-    ds = None # close dataset
 
     if opts.output_bmin is not None:
         if opts.output_bmax is not None:
@@ -151,25 +193,26 @@ for input_fnam in fnams:
         sys.stderr.write('{}\n'.format(band_name[i]))
     if flag_grid:
         sys.stderr.write('############ No need to interpolate.\n')
-        dset = data[indxs,indy1:indy2,indx1:indx2]
     else:
-        dset = []
-        for i in indxs:
-            dset.append(griddata((xp.flatten(),yp.flatten()),data[i].flatten(),(xg.flatten(),yg.flatten()),method='nearest').reshape(xg.shape))
-        dset = np.array(dset)
+        index_map = get_index_map(trans,shape)
 
-    drv = gdal.GetDriverByName('GTiff')
-    ds = drv.Create(output_fnam,nx,ny,nset,gdal.GDT_Float32)
-    ds.SetGeoTransform((opts.xmin-0.5*opts.xstp,opts.xstp,0.0,opts.ymax-0.5*opts.ystp,0.0,opts.ystp))
-    srs = osr.SpatialReference()
-    srs.ImportFromEPSG(output_epsg)
-    ds.SetProjection(srs.ExportToWkt())
-    if opts.read_comments:
-        ds.SetMetadata(comments)
-    for i in range(nset):
-        band = ds.GetRasterBand(i+1)
-        band.WriteArray(dset[i])
-        band.SetDescription(band_name[indxs[i]])
-    band.SetNoDataValue(np.nan) # The TIFFTAG_GDAL_NODATA only support one value per dataset
-    ds.FlushCache()
+    # Read, resample and write one band at a time
+    with GTiffWriter(output_fnam,nx,ny,nset,(opts.xmin-0.5*opts.xstp,opts.xstp,0.0,opts.ymax-0.5*opts.ystp,0.0,opts.ystp),
+                     prj=srs_out.ExportToWkt(),band_name=[band_name[i] for i in indxs],
+                     metadata=(comments if opts.read_comments else None)) as writer:
+        for i in range(nset):
+            band_src = ds_src.GetRasterBand(indxs[i]+1)
+            if flag_grid:
+                dset = band_src.ReadAsArray(int(indx1),int(indy1),int(indx2-indx1),int(indy2-indy1))
+            else:
+                dset = band_src.ReadAsArray().flatten()[index_map].reshape(ny,nx)
+            writer.write(dset,i)
+    ds_src = None
     ds = None # close dataset
+
+if opts.workers > 1:
+    with ProcessPoolExecutor(max_workers=opts.workers) as executor:
+        list(executor.map(resample,fnams)) # re-raise errors from workers
+else:
+    for input_fnam in fnams:
+        resample(input_fnam)
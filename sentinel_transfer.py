@@ -0,0 +1,207 @@
+import os
+import sys
+import re
+import time
+import hashlib
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+try:
+    import fcntl
+except ImportError: # not available on Windows
+    fcntl = None
+
+# Default values
+WORKERS = 2
+TIMEOUT = 60 # sec
+INTERVAL = 10 # sec
+WAIT_TIME = 10 # sec
+MAX_RETRY = 100
+CHUNK_SIZE = 1048576 # byte
+
+class TransferError(IOError):
+    pass
+
+def file_md5(fnam,chunk_size=CHUNK_SIZE):
+    h = hashlib.md5()
+    with open(fnam,'rb') as fp:
+        for chunk in iter(lambda: fp.read(chunk_size),b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+class SlotLock:
+    # Inter-process semaphore made of nslot lock files in dnam, used to limit
+    # the number of concurrent transfers across several download processes.
+    def __init__(self,dnam,nslot,interval=1.0):
+        if not os.path.isdir(dnam):
+            os.makedirs(dnam,exist_ok=True)
+        self.fnams = [os.path.join(dnam,'slot_{}.lock'.format(i)) for i in range(nslot)]
+        self.interval = interval
+
+    def acquire(self):
+        if fcntl is None:
+            return None
+        while True:
+            for fnam in self.fnams:
+                fp = open(fnam,'a')
+                try:
+                    fcntl.flock(fp,fcntl.LOCK_EX|fcntl.LOCK_NB)
+                    return fp
+                except OSError:
+                    fp.close()
+            time.sleep(self.interval)
+
+    def release(self,fp):
+        if fp is None:
+            return
+        fcntl.flock(fp,fcntl.LOCK_UN)
+        fp.close()
+
+class Downloader:
+    # Bounded pool of concurrent HTTP transfers sharing one session.
+    # callback(event,fnam,done,total,message) is called with event = start|progress|done|error|fail
+    # lock_dir: directory of per-file lock files when the same file may be downloaded by other processes
+    def __init__(self,session=None,workers=WORKERS,timeout=TIMEOUT,interval=INTERVAL,wait_time=WAIT_TIME,
+                 max_retry=MAX_RETRY,chunk_size=CHUNK_SIZE,callback=None,slot_lock=None,lock_dir=None):
+        if session is None:
+            session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers,pool_maxsize=workers)
+        session.mount('http://',adapter)
+        session.mount('https://',adapter)
+        self.session = session
+        self.workers = workers
+        self.timeout = timeout
+        self.interval = interval
+        self.wait_time = wait_time
+        self.max_retry = max_retry
+        self.chunk_size = chunk_size
+        self.callback = callback
+        self.slot_lock = slot_lock
+        self.lock_dir = lock_dir if fcntl is not None else None
+        if self.lock_dir is not None and not os.path.isdir(self.lock_dir):
+            os.makedirs(self.lock_dir,exist_ok=True)
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+    def notify(self,event,fnam,done=0,total=None,message=''):
+        if self.callback is not None:
+            self.callback(event,fnam,done,total,message)
+
+    def transfer(self,url,fnam,size=None,md5=None):
+        # Resume fnam+'.incomplete' with a Range request and update MD5 while writing.
+        # fnam is created (atomically) only when both size and MD5 match.
+        # An existing fnam (e.g. completed by another process) is accepted if its size and MD5 (when known) match.
+        gnam = fnam+'.incomplete'
+        if os.path.exists(fnam) and (size is None or os.path.getsize(fnam) == size):
+            if md5 is None or file_md5(fnam,self.chunk_size).lower() == md5.lower():
+                return os.path.getsize(fnam)
+            self.notify('error',fnam,0,size,'MD5 mismatch of the existing file, download again')
+            os.remove(fnam)
+        h = hashlib.md5()
+        done = 0
+        if os.path.exists(gnam):
+            done = os.path.getsize(gnam)
+            if size is not None and done > size:
+                done = 0
+            else:
+                with open(gnam,'rb') as fp:
+                    for chunk in iter(lambda: fp.read(self.chunk_size),b''):
+                        h.update(chunk)
+        if size is None or done < size:
+            headers = {}
+            if done > 0:
+                headers['Range'] = 'bytes={}-'.format(done)
+            # The read timeout is applied to every chunk, i.e. it is the stall timeout of the transfer.
+            with self.session.get(url,stream=True,headers=headers,timeout=(self.timeout,self.timeout)) as r:
+                if r.status_code == 206:
+                    m = re.search('bytes\s+(\d+)-',r.headers.get('Content-Range',''))
+                    if not m or int(m.group(1)) != done:
+                        raise TransferError('Error in Content-Range ({}), offset={} >>> {}'.format(r.headers.get('Content-Range'),done,url))
+                    mode = 'ab'
+                elif r.status_code == 200: # Range not supported, start over
+                    h = hashlib.md5()
+                    done = 0
+                    mode = 'wb'
+                else:
+                    raise TransferError('HTTP {} {} >>> {}'.format(r.status_code,r.reason,url))
+                if size is None and 'Content-Length' in r.headers:
+                    size = done+int(r.headers['Content-Length'])
+                self.notify('start',fnam,done,size)
+                t_last = time.time()
+                with open(gnam,mode) as fp:
+                    for chunk in r.iter_content(chunk_size=self.chunk_size):
+                        if not chunk:
+                            continue
+                        fp.write(chunk)
+                        h.update(chunk)
+                        done += len(chunk)
+                        t_now = time.time()
+                        if t_now-t_last >= self.interval:
+                            self.notify('progress',fnam,done,size)
+                            t_last = t_now
+        if size is not None and done != size:
+            raise TransferError('Error, size={}, expected={} >>> {}'.format(done,size,fnam)) # keep gnam to resume
+        if md5 is not None and h.hexdigest().lower() != md5.lower():
+            os.remove(gnam)
+            raise TransferError('Error, md5={}, expected={} >>> {}'.format(h.hexdigest(),md5,fnam))
+        os.replace(gnam,fnam)
+        return done
+
+    def download(self,url,fnam,size=None,md5=None):
+        for ntry in range(self.max_retry):
+            slot = None if self.slot_lock is None else self.slot_lock.acquire()
+            try:
+                if self.lock_dir is not None: # the same file may be downloaded by other processes
+                    with open(os.path.join(self.lock_dir,os.path.basename(fnam)+'.lock'),'a') as fp:
+                        fcntl.flock(fp,fcntl.LOCK_EX)
+                        done = self.transfer(url,fnam,size,md5)
+                else:
+                    done = self.transfer(url,fnam,size,md5)
+                self.notify('done',fnam,done,size)
+                return True
+            except Exception as e:
+                self.notify('error',fnam,0,size,'{}'.format(e))
+            finally:
+                if self.slot_lock is not None:
+                    self.slot_lock.release(slot)
+            time.sleep(self.wait_time)
+        self.notify('fail',fnam,0,size,'Maximum number of retries reached')
+        return False
+
+    def submit(self,url,fnam,size=None,md5=None):
+        return self.executor.submit(self.download,url,fnam,size,md5)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+def link_file(src,dst):
+    # Hard link dst to src, or symbolic link if a hard link is not possible
+    if os.path.lexists(dst):
+        os.remove(dst)
+    try:
+        os.link(src,dst)
+    except OSError:
+        os.symlink(os.path.abspath(src),dst)
+
+def write_progress(event,fnam,done,total,message):
+    # Default callback
+    name = os.path.basename(fnam)
+    if event == 'start':
+        sys.stderr.write('Downloading {}\n'.format(name))
+    elif event == 'progress':
+        if total:
+            sys.stderr.write('Downloading: {} {:5.1f}% ({:.1f}/{:.1f} MB)\n'.format(name,100.0*done/total,done*1.0e-6,total*1.0e-6))
+        else:
+            sys.stderr.write('Downloading: {} ({:.1f} MB)\n'.format(name,done*1.0e-6))
+    elif event == 'done':
+        sys.stderr.write('###### Successfully downloaded >>> {}\n'.format(fnam))
+    elif event == 'error':
+        sys.stderr.write('Error in download ({}) >>> {}\n'.format(message,fnam))
+    elif event == 'fail':
+        sys.stderr.write('###### Failed to download ({}) >>> {}\n'.format(message,fnam))
+    sys.stderr.flush()
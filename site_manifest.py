@@ -0,0 +1,59 @@
+import os
+import re
+import json
+import threading
+
+# Default values
+MANIFEST = 'manifest.json'
+
+def product_date(name):
+    # S1A_IW_GRDH_1SDV_20171227T223338_20171227T223405_019894_021DC8_434F
+    # S2A_MSIL2A_20190709T025559_N0212_R032_T48MYT_20190709T070503
+    m = re.search('_(\d{8})T\d{6}_',name)
+    if not m:
+        return None
+    return m.group(1)
+
+class Manifest:
+    # Per-site record of products: name -> {date (YYYYMMDD), size, status}
+    def __init__(self,fnam=MANIFEST):
+        self.fnam = fnam
+        self.lock = threading.Lock()
+        self.products = {}
+        if os.path.exists(fnam):
+            with open(fnam,'r') as fp:
+                self.products = json.load(fp)
+
+    def save(self):
+        with self.lock:
+            tmp_fnam = self.fnam+'.{}'.format(os.getpid())
+            with open(tmp_fnam,'w') as fp:
+                json.dump(self.products,fp,indent=1,sort_keys=True)
+            os.replace(tmp_fnam,self.fnam)
+
+    def update(self,name,size=None,status='downloaded',save=True):
+        name = re.sub('\.zip$','',os.path.basename(name))
+        with self.lock:
+            self.products[name] = {'date':product_date(name),'size':size,'status':status}
+        if save:
+            self.save()
+
+    def latest(self,status='downloaded'):
+        dates = [p['date'] for p in self.products.values() if p['status'] == status and p['date'] is not None]
+        if len(dates) < 1:
+            return None
+        return max(dates)
+
+    def scan(self,datdir,pattern='^S1[AB]_IW_GRDH_1SDV_\d{8}T\S+\.zip$'):
+        # Build the manifest from an existing archive (datdir/YYYY/*.zip)
+        for d in sorted(os.listdir(datdir)):
+            if not re.search('^\d\d\d\d$',d):
+                continue
+            dnam = os.path.join(datdir,d)
+            if not os.path.isdir(dnam):
+                continue
+            for f in sorted(os.listdir(dnam)):
+                if not re.search(pattern,f):
+                    continue
+                self.update(f,size=os.path.getsize(os.path.join(dnam,f)),save=False)
+        self.save()
@@ -1,9 +1,9 @@
 #!/usr/bin/env python
 import os
 import psutil
+from snap_cache import add_java_options
 mem_size = int(psutil.virtual_memory().available*0.8e-6)
-os.environ['_JAVA_OPTIONS'] = '-Xmx{}m'.format(mem_size)     # Save memory for JAVA
-os.system('export _JAVA_OPTIONS=-Xmx{}m'.format(mem_size))   # Save memory for JAVA
+add_java_options(os.environ,'-Xmx{}m'.format(mem_size)) # Save memory for JAVA
 import sys
 from snappy import ProductIO
 from optparse import OptionParser,IndentedHelpFormatter
@@ -0,0 +1,64 @@
+import os
+import sys
+import time
+import shutil
+import signal
+import tempfile
+from subprocess import Popen,TimeoutExpired
+
+# Default values
+INTERVAL = 10.0 # sec
+
+def add_java_options(env,options):
+    # Append JVM options to _JAVA_OPTIONS of env (e.g. os.environ), keeping the options already set
+    env['_JAVA_OPTIONS'] = (env.get('_JAVA_OPTIONS','')+' '+options).strip()
+
+def dir_size(dnam):
+    size = 0
+    for root,dirs,files in os.walk(dnam):
+        for f in files:
+            try:
+                size += os.path.getsize(os.path.join(root,f))
+            except OSError: # removed while walking
+                pass
+    return size
+
+class ScopedCache:
+    # Temporary and cache directory of one SNAP job, given to the JVM through _JAVA_OPTIONS
+    # (appended to the caller's options) and removed when the job exits.
+    # max_size (MB) is enforced by terminating the job.
+    def __init__(self,dnam=None,max_size=None,interval=INTERVAL):
+        self.dnam = dnam
+        self.max_size = max_size
+        self.interval = interval
+        self.path = None
+
+    def __enter__(self):
+        if self.dnam is not None and not os.path.isdir(self.dnam):
+            os.makedirs(self.dnam,exist_ok=True)
+        self.path = tempfile.mkdtemp(prefix='snap_',dir=self.dnam)
+        return self
+
+    def __exit__(self,*args):
+        shutil.rmtree(self.path,ignore_errors=True)
+
+    def environ(self):
+        env = os.environ.copy()
+        options = '-Djava.io.tmpdir={} -Dsnap.cachedir={}'.format(self.path,os.path.join(self.path,'cache'))
+        add_java_options(env,options)
+        return env
+
+    def call(self,command):
+        # Run a shell command like subprocess.call, returns the exit status
+        p = Popen(command,shell=True,env=self.environ(),start_new_session=True)
+        while True:
+            try:
+                return p.wait(timeout=self.interval)
+            except TimeoutExpired: # still running
+                pass
+            if self.max_size is not None:
+                size = dir_size(self.path)*1.0e-6
+                if size > self.max_size:
+                    sys.stderr.write('Error, cache size {:.1f} MB > {:.1f} MB, terminate >>> {}\n'.format(size,self.max_size,command))
+                    os.killpg(p.pid,signal.SIGTERM)
+                    return p.wait()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python
+import os
+import sys
+import re
+import time
+import shutil
+import runpy
+import secrets
+import traceback
+from multiprocessing.connection import Listener,Client
+from snap_cache import add_java_options
+
+# Constants
+HOME = os.environ.get('HOME')
+if HOME is None:
+    HOME = os.environ.get('HOMEPATH')
+
+# Default values
+ADDRESS = 'localhost:50007'
+KEY_FNAM = os.path.join(HOME,'.snap_server_key')
+
+def parse_address(address):
+    # host:port for a TCP socket, otherwise a Unix socket path
+    m = re.search('^([^:/]+):(\d+)$',address)
+    if m:
+        return (m.group(1),int(m.group(2)))
+    return address
+
+def get_authkey(key_fnam=KEY_FNAM,create=False):
+    # SNAP_SERVER_AUTHKEY, or a random key shared through a user-only file
+    key = os.environ.get('SNAP_SERVER_AUTHKEY')
+    if key is not None:
+        return key.encode()
+    if not os.path.exists(key_fnam):
+        if not create:
+            raise IOError('Error, no such file >>> '+key_fnam)
+        fd = os.open(key_fnam,os.O_WRONLY|os.O_CREAT|os.O_EXCL,0o600)
+        with os.fdopen(fd,'w') as fp:
+            fp.write(secrets.token_hex(32))
+    with open(key_fnam,'r') as fp:
+        return fp.read().strip().encode()
+
+def run_job(address,script,args=[],cwd=None,key_fnam=KEY_FNAM):
+    # Send a job to the server and wait for it, returns the exit status like subprocess.call
+    conn = Client(parse_address(address),authkey=get_authkey(key_fnam))
+    try:
+        conn.send({'script':script,'args':list(args),'cwd':os.getcwd() if cwd is None else cwd})
+        result = conn.recv()
+    finally:
+        conn.close()
+    if result['status'] != 0 and result['message']:
+        sys.stderr.write(result['message'])
+    return result['status']
+
+def execute(job):
+    # Run a script in this process as if it were started from the command line
+    script = job['script']
+    if not os.path.exists(script):
+        path = shutil.which(script)
+        if path is None:
+            return {'status':127,'message':'Error, no such script >>> {}\n'.format(script)}
+        script = path
+    argv = sys.argv
+    cwd = os.getcwd()
+    status = 0
+    message = ''
+    try:
+        sys.argv = [script]+job['args']
+        os.chdir(job['cwd'])
+        runpy.run_path(script,run_name='__main__')
+    except SystemExit as e:
+        if e.code is None:
+            status = 0
+        elif isinstance(e.code,int):
+            status = e.code
+        else:
+            status = 1
+            message = '{}\n'.format(e.code)
+    except Exception:
+        status = 1
+        message = traceback.format_exc()
+    finally:
+        sys.argv = argv
+        os.chdir(cwd)
+    return {'status':status,'message':message}
+
+def serve(address=ADDRESS,key_fnam=KEY_FNAM,heap_size=None):
+    # Start the JVM and load the GPF operators once, then run jobs one at a time
+    if heap_size is None:
+        import psutil
+        heap_size = int(psutil.virtual_memory().available*0.8e-6)
+    add_java_options(os.environ,'-Xmx{}m'.format(heap_size))
+    from snappy import GPF
+    GPF.getDefaultInstance().getOperatorSpiRegistry().loadOperatorSpis()
+    address = parse_address(address)
+    if isinstance(address,str) and os.path.exists(address):
+        os.remove(address)
+    with Listener(address,authkey=get_authkey(key_fnam,create=True)) as listener:
+        sys.stderr.write('###### SNAP server is ready >>> {}\n'.format(address))
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e: # authentication error etc.
+                sys.stderr.write('Error in connection ({})\n'.format(e))
+                continue
+            try:
+                job = conn.recv()
+                if job.get('script') is None: # stop request
+                    conn.send({'status':0,'message':''})
+                    break
+                t1 = time.time()
+                sys.stderr.write('###### Start >>> {} {}\n'.format(job['script'],' '.join(job['args'])))
+                result = execute(job)
+                sys.stderr.write('###### Finish ({}, {:.1f} sec) >>> {}\n'.format(result['status'],time.time()-t1,job['script']))
+                conn.send(result)
+            except (EOFError,OSError) as e: # client disconnected
+                sys.stderr.write('Error in job ({})\n'.format(e))
+            finally:
+                conn.close()
+
+if __name__ == '__main__':
+    from optparse import OptionParser,IndentedHelpFormatter
+
+    # Read options
+    parser = OptionParser(formatter=IndentedHelpFormatter(max_help_position=200,width=200))
+    parser.add_option('-a','--address',default=ADDRESS,help='Server address, host:port or Unix socket path (%default)')
+    parser.add_option('-k','--key_fnam',default=KEY_FNAM,help='Authentication key file, ignored if SNAP_SERVER_AUTHKEY is set (%default)')
+    parser.add_option('--heap_size',default=None,type='int',help='Java heap size in MB (80%% of available memory)')
+    parser.add_option('--stop',default=False,action='store_true',help='Stop the running server (%default)')
+    (opts,args) = parser.parse_args()
+
+    if opts.stop:
+        conn = Client(parse_address(opts.address),authkey=get_authkey(opts.key_fnam))
+        conn.send({'script':None})
+        conn.recv()
+        conn.close()
+    else:
+        serve(opts.address,opts.key_fnam,opts.heap_size)
@@ -1,11 +1,14 @@
 #!/usr/bin/env python
 import sys
 import numpy as np
+from peak_groups import sort_peaks,search_segments
 from optparse import OptionParser,IndentedHelpFormatter
 
 # Default values
 XSGM = 5.0 # day
 LSGM = 50.0 # m
+XGAP = 45.0 # day
+CHUNK = 1000000 # pairs
 
 # Read options
 parser = OptionParser(formatter=IndentedHelpFormatter(max_help_position=200,width=200))
@@ -72,43 +75,53 @@ if opts.ngrd is None:
     opts.ngrd = ntmp
 elif opts.ngrd != ntmp:
     sys.stderr.write('Warning, opts.ngrd={}, ntmp={}\n'.format(opts.ngrd,ntmp))
-xpek_sid = [[] for i in range(opts.ngrd)]
-ypek_sid = [[] for i in range(opts.ngrd)]
-for i,x,y in zip(sid,xpek,ypek):
-    xpek_sid[i].append(x)
-    ypek_sid[i].append(y)
-for i in range(opts.ngrd):
-    xpek_sid[i] = np.array(xpek_sid[i])
-    ypek_sid[i] = np.array(ypek_sid[i])
+if np.any(sid_0[:opts.ngrd] != np.arange(opts.ngrd)):
+    i = np.argmax(sid_0[:opts.ngrd] != np.arange(opts.ngrd))
+    raise ValueError('Error, i={}, sid_0={}'.format(i,sid_0[i]))
 
-for i in range(opts.ngrd):
-    if i != sid_0[i]:
-        raise ValueError('Error, i={}, sid_0={}'.format(i,sid_0[i]))
-    sind = []
-    eind = []
-    ind1 = np.arange(xpek_sid[i].size)
-    if ind1.size > 0:
-        sind.append(ind1[0])
-        dind = np.diff(xpek_sid[i])
-        ind2 = np.where(dind > 45.0)[0]
-        if ind2.size > 0:
-            for itmp in ind2:
-                eind.append(ind1[itmp])
-                sind.append(ind1[itmp+1])
-        eind.append(ind1[-1])
-    for si,ei in zip(sind,eind):
-        ysum = []
-        for xi,yi in zip(xpek_sid[i][si:ei+1],ypek_sid[i][si:ei+1]):
-            ys = yi
-            for j,leng in zip([sid_1[i],sid_2[i],sid_3[i],sid_4[i],sid_5[i],sid_6[i],sid_7[i],sid_8[i],sid_9[i],sid_a[i],sid_b[i],sid_c[i]],
-                              [leng_1[i],leng_2[i],leng_3[i],leng_4[i],leng_5[i],leng_6[i],leng_7[i],leng_8[i],leng_9[i],leng_a[i],leng_b[i],leng_c[i]]):
-                for xj,yj in zip(xpek_sid[j],ypek_sid[j]):
-                    if np.abs(xj-xi) < opts.xsgm*10.0:
-                        ys += yj*np.exp(-0.5*np.square((xj-xi)/opts.xsgm))*np.exp(-0.5*np.square(leng/opts.lsgm))
-            ysum.append(ys)
-        ysum = np.array(ysum)
-        x = xpek_sid[i][si:ei+1]
-        y = ypek_sid[i][si:ei+1]
-        j = np.argmax(ysum)
-        sys.stdout.write('{:8d} {:15.8e} {:8.3f} {:8.3f}\n'.format(i,x[j],y[j],ysum[j]))
-    #break
+# Peaks of each cell sorted by time (CSR)
+indx,ptr = sort_peaks(sid,xpek,opts.ngrd)
+xs = xpek[indx]
+ps = ypek[indx]
+
+# Peaks in the file order of each cell
+order = np.argsort(sid,kind='stable')
+sid = sid[order]
+xpek = xpek[order]
+ypek = ypek[order]
+npek = sid.size
+
+# Superpose gaussians of the neighbour peaks within 10*xsgm
+xlim = opts.xsgm*10.0
+ysum = ypek.astype(np.float64)
+for nbr,leng in zip([sid_1,sid_2,sid_3,sid_4,sid_5,sid_6,sid_7,sid_8,sid_9,sid_a,sid_b,sid_c],
+                    [leng_1,leng_2,leng_3,leng_4,leng_5,leng_6,leng_7,leng_8,leng_9,leng_a,leng_b,leng_c]):
+    fact = np.exp(-0.5*np.square(leng/opts.lsgm)) # spatial weight of this stencil offset for each cell
+    j = nbr[sid]
+    start = ptr[j]
+    end = ptr[j+1]
+    lo = search_segments(xs,start,end,xpek-xlim,side='right')
+    hi = search_segments(xs,start,end,xpek+xlim,side='left')
+    npair = hi-lo
+    cnum = np.cumsum(npair)
+    p1 = 0
+    while p1 < npek: # batches of about CHUNK candidate pairs
+        p2 = max(np.searchsorted(cnum,cnum[p1]-npair[p1]+CHUNK,side='right'),p1+1)
+        n = npair[p1:p2]
+        ip = np.repeat(np.arange(p1,p2),n)
+        if ip.size > 0:
+            iq = lo[ip]+np.arange(ip.size)-np.repeat(np.cumsum(n)-n,n)
+            dx = xs[iq]-xpek[ip]
+            cnd = (np.abs(dx) < xlim)
+            w = ps[iq]*np.exp(-0.5*np.square(dx/opts.xsgm))*fact[sid[ip]]
+            ysum[p1:p2] += np.bincount(ip[cnd]-p1,weights=w[cnd],minlength=p2-p1)
+        p1 = p2
+
+# Clusters separated by gaps longer than XGAP in each cell, keep the peak with max. ysum
+if npek > 0:
+    flag = np.r_[True,(sid[1:] != sid[:-1]) | (np.diff(xpek) > XGAP)]
+    sind = np.flatnonzero(flag)
+    cid = np.cumsum(flag)-1
+    cmax = np.maximum.reduceat(ysum,sind)
+    k = np.minimum.reduceat(np.where(ysum == cmax[cid],np.arange(npek),npek),sind)
+    np.savetxt(sys.stdout,np.column_stack((sid[k],xpek[k],ypek[k],ysum[k])),fmt='%8d %15.8e %8.3f %8.3f')
@@ -5,12 +5,13 @@ import glob
 from datetime import datetime,timedelta
 import numpy as np
 from subprocess import call
-from vh_2 import *
+from gdal_stack import same_grid,stack
 
 bindir = '.'
 datdir = '../190906/vh'
 polarization = 'VH'
 period = 60 # days
+cubnam = 'collocation_all.vrt'
 
 # Create a filelist
 dates = []
@@ -24,6 +25,22 @@ indx = np.argsort(dates)
 datelist = dates[indx]
 filelist = np.array(files)[indx]
 
+# Stack all dates once, each window reads its bands from the cube
+data = [str(fnam) for fnam in filelist if os.path.exists(fnam)]
+if same_grid(data):
+    stack(data,cubnam)
+else: # collocate once with SNAP
+    cubnam = 'collocation_all.tif'
+    command = os.path.join(bindir,'sen2_collocate.py')
+    command += ' --snap'
+    command += ' --band 0'
+    command += ' --output_fnam {}'.format(cubnam)
+    command += ' '+' '.join(data)
+    sys.stderr.write(command+'\n')
+    call(command,shell=True)
+
+# Analyze all windows in one run, writing collocation_YYMMDD_YYMMDD.dat for each window
+ends = []
 data_prev = []
 for d1 in datelist:
     d0 = d1-timedelta(days=period)
@@ -40,14 +57,16 @@ for d1 in datelist:
         #print(d0,d1,date)
     if data == data_prev:
         continue
-    gnam = 'collocation_{:%y%m%d}_{:%y%m%d}.tif'.format(d0,d1)
-    collocate_all(data,write_product=True,write_fnam=gnam)
+    ends.append(d1.strftime('%Y%m%d'))
+    data_prev = data
+if len(ends) < 1:
+    sys.stderr.write('###### No window of {} days in the data period >>> {}\n'.format(period,datdir))
+else:
     command = os.path.join(bindir,'get_vh_minimum.py')
-    command += ' {}'.format(gnam)
-    command += ' -e {}'.format(d1.strftime('%Y%m%d'))
+    command += ' {}'.format(cubnam)
+    command += ' --ends {}'.format(','.join(ends))
+    command += ' -p {}'.format(period)
     command += ' -s ../../SATREPS/New_Test_Sites/New_Test_Sites.shp'
-    command += ' -o collocation_{:%y%m%d}_{:%y%m%d}.dat'.format(d0,d1)
+    command += ' --out_dir .'
     sys.stderr.write(command+'\n')
     call(command,shell=True)
-    data_prev = data
-    #break
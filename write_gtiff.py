@@ -1,57 +1,63 @@
 #!/usr/bin/env python
 import os
 import sys
-import shutil
-from datetime import datetime,timedelta
+from datetime import datetime
 import numpy as np
-import gdal
-import osr
 from matplotlib.dates import date2num
+from gtiff_writer import write_tiff
+from optparse import OptionParser,IndentedHelpFormatter
 
-outnam = os.path.join('.','transplanting_date.tif')
-d0 = date2num(datetime(2017,3,1))
-d1 = d0+180.0
+# Default values
+OUTNAM = os.path.join('.','transplanting_date.tif')
+PEAK_FNAM = 'thinout_peaks.dat'
+TMIN = '20170301'
+TMAX = '20170828'
+EPSG = 32748
+XMIN = 743800.0 # pixel center
+XMAX = 756800.0 # pixel center
+YMIN = 9236000.0 # pixel center
+YMAX = 9251800.0 # pixel center
+XSTP = 10.0
+YSTP = -10.0
 
-xstp = 10.0
-ystp = -10.0
-xmin,xmax,ymin,ymax = (743800.0,756800.0,9236000.0,9251800.0)
-xg,yg = np.meshgrid(np.arange(xmin,xmax+0.1*xstp,xstp),np.arange(ymax,ymin-0.1*ystp,ystp))
+# Read options
+parser = OptionParser(formatter=IndentedHelpFormatter(max_help_position=200,width=200))
+parser.add_option('-p','--peak_fnam',default=PEAK_FNAM,help='Peak file, format: sid xpek ypek (%default)')
+parser.add_option('-o','--outnam',default=OUTNAM,help='Output GeoTIFF name (%default)')
+parser.add_option('-s','--tmin',default=TMIN,help='Min date of peaks in the format YYYYMMDD (%default)')
+parser.add_option('-e','--tmax',default=TMAX,help='Max date of peaks in the format YYYYMMDD (%default)')
+parser.add_option('--epsg',default=EPSG,type='int',help='Output EPSG (%default)')
+parser.add_option('-x','--xmin',default=XMIN,type='float',help='Minimum X in m (%default)')
+parser.add_option('-X','--xmax',default=XMAX,type='float',help='Maximum X in m (%default)')
+parser.add_option('--xstp',default=XSTP,type='float',help='Step X in m (%default)')
+parser.add_option('-y','--ymin',default=YMIN,type='float',help='Minimum Y in m (%default)')
+parser.add_option('-Y','--ymax',default=YMAX,type='float',help='Maximum Y in m (%default)')
+parser.add_option('--ystp',default=YSTP,type='float',help='Step Y in m (%default)')
+(opts,args) = parser.parse_args()
+
+d0 = date2num(datetime.strptime(opts.tmin,'%Y%m%d'))
+d1 = date2num(datetime.strptime(opts.tmax,'%Y%m%d'))
+xg,yg = np.meshgrid(np.arange(opts.xmin,opts.xmax+0.1*opts.xstp,opts.xstp),np.arange(opts.ymax,opts.ymin-0.1*opts.ystp,opts.ystp)) # same grid as find_nearest_pixel.py
 ngrd = xg.size
 ny,nx = xg.shape
 
 #sid,xpek,ypek,ns,ymax = np.loadtxt('thinout_peaks.dat',unpack=True)
-sid,xpek,ypek = np.loadtxt('thinout_peaks.dat',unpack=True)
+sid,xpek,ypek = np.loadtxt(opts.peak_fnam,unpack=True,ndmin=2)
 sid = (sid+0.1).astype(np.int64)
-xpek_sid = [[] for i in range(ngrd)]
-ypek_sid = [[] for i in range(ngrd)]
-for i,x,y in zip(sid,xpek,ypek):
-    if x >= d0 and x <= d1:
-        xpek_sid[i].append(x)
-        ypek_sid[i].append(y)
-for i in range(ngrd):
-    ndat = len(xpek_sid[i])
-    if ndat > 1:
-        indx = np.argmin(xpek_sid[i])
-        xpek_sid[i] = [xpek_sid[i][indx]]
-        ypek_sid[i] = [ypek_sid[i][indx]]
-    elif ndat < 1:
-        xpek_sid[i].append(np.nan)
-        ypek_sid[i].append(np.nan)
-xpek_sid = np.array(xpek_sid)
-ypek_sid = np.array(ypek_sid)
+cnd = (xpek >= d0) & (xpek <= d1)
+sid = sid[cnd]
+xpek = xpek[cnd]
+ypek = ypek[cnd]
+if sid.size > 0 and (sid.min() < 0 or sid.max() >= ngrd):
+    raise ValueError('Error, sid.min()={}, sid.max()={}, ngrd={}'.format(sid.min(),sid.max(),ngrd))
+
+# Earliest peak in each cell (lexsort is stable, ties keep the file order)
+indx = np.lexsort((xpek,sid))
+sid_sorted = sid[indx]
+first = np.flatnonzero(np.r_[True,sid_sorted[1:] != sid_sorted[:-1]]) if sid.size > 0 else np.array([],dtype=np.int64)
+band_data = np.full((2,ngrd),np.nan,dtype=np.float32)
+band_data[0,sid_sorted[first]] = xpek[indx[first]]
+band_data[1,sid_sorted[first]] = ypek[indx[first]]
 
-drv = gdal.GetDriverByName('GTiff')
-ds = drv.Create(outnam,nx,ny,2,gdal.GDT_Float32)
-ds.SetGeoTransform((xmin-0.5*xstp,xstp,0.0,ymax-0.5*ystp,0.0,ystp))
-srs = osr.SpatialReference()
-srs.ImportFromEPSG(32748)
-ds.SetProjection(srs.ExportToWkt())
-band_data = [xpek_sid,ypek_sid]
 band_name = ['xpek','ypek']
-for i in range(2):
-    band = ds.GetRasterBand(i+1)
-    band.WriteArray(band_data[i].reshape(xg.shape))
-    band.SetDescription(band_name[i])
-band.SetNoDataValue(np.nan) # The TIFFTAG_GDAL_NODATA only support one value per dataset
-ds.FlushCache()
-ds = None # close dataset
+write_tiff(opts.outnam,band_data.reshape(2,ny,nx),(opts.xmin-0.5*opts.xstp,opts.xstp,0.0,opts.ymax-0.5*opts.ystp,0.0,opts.ystp),epsg=opts.epsg,band_name=band_name)
@@ -1,41 +1,46 @@
 #!/usr/bin/env python
 import os
 import sys
-import shutil
 from datetime import datetime
 import numpy as np
 import shapefile
 from matplotlib.dates import date2num
+from field_join import group_fields,write_fields
+from optparse import OptionParser,IndentedHelpFormatter
 
-inpnam = os.path.join('../../SATREPS','New_Test_Sites','New_Test_Sites')
-outnam = os.path.join('.','transplanting_date')
-d0 = date2num(datetime(2019,3,20))
-d1 = date2num(datetime(2019,6,20))
+# Default values
+INPNAM = os.path.join('../../SATREPS','New_Test_Sites','New_Test_Sites')
+OUTNAM = os.path.join('.','transplanting_date')
+PEAK_FNAM = 'thinout_peaks.dat'
+TMIN = '20190320'
+TMAX = '20190620'
+BAND_NAME = 'trans_date,peak_value'
 
-#sid,xpek,ypek,ns,ymax = np.loadtxt('thinout_peaks.dat',unpack=True)
-sid,xpek,ypek = np.loadtxt('thinout_peaks.dat',unpack=True)
-sid = (sid+0.1).astype(np.int64)
+# Read options
+parser = OptionParser(formatter=IndentedHelpFormatter(max_help_position=200,width=200))
+parser.add_option('-i','--inpnam',default=INPNAM,help='Input shapefile name (%default)')
+parser.add_option('-o','--outnam',default=OUTNAM,help='Output shapefile name (%default)')
+parser.add_option('-p','--peak_fnam',default=PEAK_FNAM,help='Peak file, format: sid xpek ypek (%default)')
+parser.add_option('-s','--tmin',default=TMIN,help='Min date of peaks in the format YYYYMMDD (%default)')
+parser.add_option('-e','--tmax',default=TMAX,help='Max date of peaks in the format YYYYMMDD (%default)')
+parser.add_option('-n','--npy_fnam',default=None,help='Per-field npy file (nband,nobject) used instead of the peak file, e.g. output of calc_trans_date_shapefile.py (%default)')
+parser.add_option('-b','--band_name',default=None,help='Comma-separated field names ({} for the peak file, band_N for the npy file)'.format(BAND_NAME))
+(opts,args) = parser.parse_args()
 
-r = shapefile.Reader(inpnam)
-w = shapefile.Writer(outnam)
-w.shapeType = shapefile.POLYGON
-w.fields = r.fields[1:] # skip first deletion field
-w.field('trans_date','F',13,6)
-w.field('peak_value','F',13,6)
-for i,shaperec in enumerate(r.iterShapeRecords()):
-    rec = shaperec.record
-    shp = shaperec.shape
-    cnd = (np.abs(sid-i) < 1.0e-4) & (xpek > d0) & (xpek < d1)
-    ndat = cnd.sum()
-    if ndat > 1:
-        raise ValueError('Error, i={}, ndat={}'.format(i,ndat))
-    elif ndat < 1:
-        rec.append(0.0)
-        rec.append(0.0)
-    else:
-        rec.append(xpek[cnd][0])
-        rec.append(ypek[cnd][0])
-    w.shape(shp)
-    w.record(*rec)
-w.close()
-shutil.copy2(inpnam+'.prj',outnam+'.prj')
+nobject = len(shapefile.Reader(opts.inpnam))
+if opts.npy_fnam is not None:
+    data = np.atleast_2d(np.load(opts.npy_fnam))
+    fill = None
+    if opts.band_name is None:
+        opts.band_name = ','.join(['band_{}'.format(i+1) for i in range(len(data))])
+else:
+    d0 = date2num(datetime.strptime(opts.tmin,'%Y%m%d'))
+    d1 = date2num(datetime.strptime(opts.tmax,'%Y%m%d'))
+    #sid,xpek,ypek,ns,ymax = np.loadtxt('thinout_peaks.dat',unpack=True)
+    sid,xpek,ypek = np.loadtxt(opts.peak_fnam,unpack=True)
+    sid = (sid+0.1).astype(np.int64)
+    data,count = group_fields(sid,[xpek,ypek],nobject,cnd=(xpek > d0) & (xpek < d1))
+    fill = 0.0
+    if opts.band_name is None:
+        opts.band_name = BAND_NAME
+write_fields(opts.inpnam,opts.outnam,data,opts.band_name.split(','),fill=fill)